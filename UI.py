@@ -1,15 +1,19 @@
 import weakref
 import asyncio
+import heapq
+import time
+from collections import OrderedDict
 import discord
-from anytree import NodeMixin, PreOrderIter
+from anytree import NodeMixin
 
 class UI:
     """Class for managing emoji UI. Includes the following elements by default: min, max, close. Pass a list of element
-     names as a tuple to create a custom layout. Supported elements are: min, max, close. """
+     names as a tuple to create a custom layout. Supported elements are: min, max, close, previous, next. """
     def __init__(self, parent, element_list=('max', 'min', 'close')):
         self.parent = weakref.ref(parent)
         self.standard_elements = {'max': ('➕', self.maximize), 'min': ('➖', self.minimize), 'close': ('✖', self.close),
-                                  'help': ('❓', self.help), 'show_spoiler': ('🔍', self.show_spoiler)}
+                                  'help': ('❓', self.help), 'show_spoiler': ('🔍', self.show_spoiler),
+                                  'previous': ('◀', self.previous_page), 'next': ('▶', self.next_page)}
         self.elements = {}
         self.element_list = list(element_list)
         self.set_elements(self.element_list)
@@ -38,56 +42,58 @@ class UI:
             emoji, func = self.standard_elements[element]
             self.elements[emoji] = func
 
-    def perm_check(self, reaction, user):
+    def perm_check(self, user):
         """Checks that the user has sufficient permissions to interact with the UI."""
-        return (self.is_parent_user(user) or self.is_admin) and not user.bot
+        return user is not None and not user.bot and (self.is_parent_user(user) or self.is_admin(user))
 
     def is_parent_user(self, user):
-        if user in [node.parent_user for node in PreOrderIter(self.parent().root)]:
-            return True
+        return user.id in self.parent().root.authorized_users
 
     def is_admin(self, user):
-        return user.permissions_in(self.parent().bot_message.channel).administrator
+        channel = self.parent().bot_message.channel
+        return hasattr(channel, 'guild') and user.permissions_in(channel).administrator
+
+    def get_user(self, user_id):
+        """Gets the reacting user, as a member where the message is in a server so permissions can be checked"""
+        guild = getattr(self.parent().bot_message.channel, 'guild', None)
+        if guild:
+            return guild.get_member(user_id)
+        return self.parent().bot.get_user(user_id)
 
-    async def add_reactions(self):
-        for key in self.elements:
-            await self.parent().bot_message.add_reaction(key)
+    def add_reactions(self, bot):
+        """Queues the reaction buttons, they are added after any previews waiting to be sent in the channel"""
+        bot.outbound.add_reactions(self.parent().bot_message, self.elements)
 
     async def start(self, bot):
-        """Adds reaction buttons and polls UI. """
-        await self.add_reactions()
-        try:
-            keep_open = True
-            while keep_open:
-                reaction = await bot.wait_for('reaction_add', timeout=86400, check=self.perm_check)
-                action = user_action(self.parent, reaction)
-                try:
-                    for node in PreOrderIter(self.parent().root):
-                        if action.message.id == node.bot_message.id:
-                            action.parent = weakref.ref(node)
-                            keep_open = await node.ui.elements[str(action.emoji)](action)
-                except KeyError:
-                    pass
-        except asyncio.TimeoutError:
-            pass
+        """Registers the UI for reactions and adds reaction buttons."""
+        bot.reactions.register(self.parent())
+        self.add_reactions(bot)
+
+    async def react(self, emoji, user_id):
+        """Runs the element for a reaction added to this UI's message. Only a permitted use of an element counts as use
+        of the response for its expiry."""
+        func = self.elements.get(emoji)
+        if func:
+            user = self.get_user(user_id)
+            if self.perm_check(user):
+                self.parent().bot.reactions.touch(self.parent().bot_message.id)
+                await func(user_action(self.parent, emoji, user))
 
 
 # Standard UI functions
     async def close(self, action):
         """Deletes message."""
-        return await action.parent().close()
+        await action.parent().close()
 
     async def minimize(self, action):
         """Sets message size to minimum."""
         if action.parent().update_size('std'):
-            await action.parent().bot_message.edit(embed=self.parent().embed)
-        return True
+            action.parent().bot.outbound.edit(action.parent().bot_message, embed=self.parent().embed)
 
     async def maximize(self, action):
         """Sets message size to maximum."""
         if action.parent().update_size('max'):
-            await action.parent().bot_message.edit(embed=self.parent().embed)
-        return True
+            action.parent().bot.outbound.edit(action.parent().bot_message, embed=self.parent().embed)
 
     async def help(self, action):
         """Shows help message."""
@@ -100,28 +106,102 @@ class UI:
 
         action.parent().ui -= 'help'
         await response.send()
-        return True
 
     async def show_spoiler(self, action):
         """DMs spoiler content to you."""
-        message = action.parent().raw_content
-        for i in range(0, (message.count(action.parent().bot.spoiler_mask))):
-            message = message.replace(action.parent().bot.spoiler_mask, str(action.parent().spoilers[i]), 1)
-        embed = action.parent().embed
-        embed.description = message
+        # A copy, the parent's embed is still shown publicly and may have an edit queued
+        embed = discord.Embed.from_dict(action.parent().embed.to_dict())
+        embed.description = action.parent().revealed_content()
         response = CloseableResponse(action.parent().bot_message, action.parent().bot, embed, parent=action.parent(),
                                      parent_user=action.user.id, persistent=True)
         await response.dm(action.user)
-        return True
+
+    async def previous_page(self, action):
+        """Shows the previous preview."""
+        action.parent().flip(-1)
+
+    async def next_page(self, action):
+        """Shows the next preview."""
+        action.parent().flip(1)
 
 
 class user_action:
     """Class containing user ui interactions"""
-    def __init__(self, parent, reaction):
-        self.emoji = reaction[0]
+    def __init__(self, parent, emoji, user):
+        self.emoji = emoji
         self.parent = parent
-        self.user = reaction[1]
-        self.message = reaction[0].message
+        self.user = user
+
+
+class reaction_dispatcher:
+    """Routes reactions to the UI of the response they were added to by looking up the message id. Responses expire
+    once the UI lifetime passes without an interaction, and when more than the maximum number of responses are live the
+    least recently used are expired early. Expired responses have their reactions removed and are dropped. Expiry times
+    are kept in a heap checked by a single periodic task."""
+    def __init__(self, bot):
+        self.bot = bot
+        self.responses = OrderedDict()
+        self.expires = {}
+        self.expiry = []
+        self.task = None
+
+    def __len__(self):
+        return len(self.responses)
+
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.ensure_future(self.sweep())
+
+    def stop(self):
+        if self.task:
+            self.task.cancel()
+            self.task = None
+
+    def register(self, response):
+        message_id = response.bot_message.id
+        self.responses[message_id] = response
+        self.touch(message_id)
+        heapq.heappush(self.expiry, (self.expires[message_id], message_id))
+        while len(self.responses) > self.bot.settings.ui_max_live:
+            self.expire(next(iter(self.responses.values())))
+
+    def unregister(self, response):
+        message_id = response.bot_message.id
+        self.responses.pop(message_id, None)
+        self.expires.pop(message_id, None)
+
+    def touch(self, message_id):
+        """Marks a response as just used"""
+        self.responses.move_to_end(message_id)
+        self.expires[message_id] = time.monotonic() + self.bot.settings.ui_lifetime
+
+    def expire(self, response):
+        self.unregister(response)
+        self.bot.outbound.strip_reactions(response.bot_message, response.ui.elements)
+
+    async def sweep(self):
+        """Expires responses whose lifetime has passed. Heap entries for closed responses are skipped and entries for
+        responses used since they were pushed are pushed again with their new expiry time."""
+        while True:
+            await asyncio.sleep(self.bot.settings.ui_sweep_interval)
+            now = time.monotonic()
+            while self.expiry and self.expiry[0][0] <= now:
+                expires, message_id = heapq.heappop(self.expiry)
+                if message_id not in self.responses:
+                    continue
+                if self.expires[message_id] > now:
+                    heapq.heappush(self.expiry, (self.expires[message_id], message_id))
+                else:
+                    self.expire(self.responses[message_id])
+            if len(self.expiry) > 2 * len(self.responses) + 1000:
+                self.expiry = [(expires, message_id) for message_id, expires in self.expires.items()]
+                heapq.heapify(self.expiry)
+
+    async def dispatch(self, payload):
+        """Handles a raw reaction add event"""
+        response = self.responses.get(payload.message_id)
+        if response and payload.user_id != self.bot.user.id:
+            await response.ui.react(str(payload.emoji), payload.user_id)
 
 # Standard response classes
 
@@ -139,39 +219,53 @@ class UIResponse(NodeMixin):
         else:
             self.ui = UI(self)
         self.embed = message
-        self.user_message = user_message
+        # Only the channel is kept, the user's message isn't needed once the response is built
+        self.channel = user_message.channel
         self.bot = bot
         self.help_text = help_text
         self.spoilers = spoilers
+        self.revealed = None
         self.persistent = persistent
         if parent_user:
             self.parent_user = parent_user
         else:
             self.parent_user = user_message.author
+        # Users allowed to use the UI are kept on the root as ids, parent_user may be either a user or an id
+        self.authorized_users = set()
+        self.root.authorized_users.add(getattr(self.parent_user, 'id', self.parent_user))
         if spoilers:
             self.ui += 'show_spoiler'
         if help_text:
             self.ui += 'help'
 
     async def close(self):
+        """Deletes this response and its descendants, except persistent ones, in one batch"""
         if self.parent:
             self.parent.children = self.siblings
-        for node in self.descendants:
-            if not node.persistent:
-                await node.close()
-        await self.bot_message.delete()
-        if not self.parent and not self.siblings:
-            return False
-        else:
-            return True
+        closing = [self] + [node for node in self.descendants if not node.persistent]
+        for node in closing:
+            self.bot.reactions.unregister(node)
+        self.bot.outbound.delete([node.bot_message for node in closing])
+
+    def revealed_content(self):
+        """Returns the content with each spoiler mask replaced by its spoiler. Built once on first use."""
+        if self.revealed is None:
+            parts = self.raw_content.split(self.bot.spoiler_mask)
+            revealed = [parts[0]]
+            for i, part in enumerate(parts[1:]):
+                revealed.append(str(self.spoilers[i]) if i < len(self.spoilers) else self.bot.spoiler_mask)
+                revealed.append(part)
+            self.revealed = ''.join(revealed)
+        return self.revealed
 
     async def send(self):
         """Sends message and starts UI"""
-        self.bot_message = await self.user_message.channel.send(embed=self.embed)
+        self.bot_message = await self.bot.outbound.send(self.channel, embed=self.embed)
         await self.ui.start(self.bot)
 
     async def dm(self, user):
-        self.bot_message = await user.send(embed=self.embed)
+        channel = user.dm_channel or await user.create_dm()
+        self.bot_message = await self.bot.outbound.send(channel, embed=self.embed)
         await self.ui.start(self.bot)
 
 
@@ -182,54 +276,127 @@ class CloseableResponse(UIResponse):
 
 
 class ResizeableResponse(UIResponse):
-    """Creates an embedded message that is resizeable and closeable"""
-    def __init__(self, user_message, bot, message, size="std", **kwargs):
-        self.size = size
-        self.lines = []
-        self.get_lines(message.description, bot.settings.line_length)
-        ui_elements = None
-        if len(self.lines) < bot.settings.std_lines:
+    """Creates an embedded message that is resizeable and closeable. The description for each size is rendered once
+    when the response is created, resizing only swaps them."""
+    def __init__(self, user_message, bot, message, size="std", ui_elements=None, **kwargs):
+        # Not named size, newer versions of anytree's NodeMixin have a size property
+        self.current_size = size
+        lines = self.get_lines(message.description, bot.settings.line_length)
+        if ui_elements is None and len(lines) < bot.settings.std_lines:
             ui_elements = ["close"]
         UIResponse.__init__(self, user_message, bot, message, ui_elements=ui_elements, **kwargs)
-        self.select_lines()
-
-    def get_lines(self, content, line_length):
-        """Breaks the messages content into a series of lines roughly corresponding with one line of text on mobile"""
-        while content != '':
-            new_line = content.split('\n', 1)[0] + '\n'
-            if len(new_line) > line_length:
-                new_line = content[:line_length-1]
-                content = content[len(new_line):]
+        self.descriptions = self.sized_descriptions(lines)
+        self.embed.description = self.descriptions[self.current_size]
+
+    @staticmethod
+    def get_lines(content, line_length):
+        """Breaks the messages content into a series of lines roughly corresponding with one line of text on mobile.
+        Lines longer than line_length are broken into pieces of line_length - 1 characters."""
+        lines = []
+        position = 0
+        line_end = -1
+        while position < len(content):
+            if line_end < position:
+                line_end = content.find('\n', position)
+                if line_end == -1:
+                    line_end = len(content)
+            if line_end - position + 1 > line_length:
+                lines.append(content[position:position + line_length - 1])
+                position += line_length - 1
             else:
-                content = content[len(new_line):]
-            self.lines.append(str(new_line))
-
-    def no_lines(self):
-        """Returns the number of lines for a given setting"""
-        if self.size == 'max':
-            no = self.bot.settings.max_lines
-        else:
-            no = self.bot.settings.std_lines
-        if no > len(self.lines):
-            no = len(self.lines)
-        return no
-
-    def select_lines(self):
-        """Selects the specified number of lines places them in embed.description"""
-        self.embed.description = ''
-        for line in range(0, self.no_lines()):
-            self.embed.description += self.lines[line]
-        if len(self.embed.description) > self.bot.settings.max_chars:
-            self.embed.description = self.embed.description[:self.bot.settings.max_chars]
-        if self.embed.description.count('```') % 2 != 0:
-            self.embed.description += '```'
-        if len(self.lines) > self.no_lines():
-            self.embed.description += '\n*Continued...*'
+                lines.append(content[position:line_end] + '\n')
+                position = line_end + 1
+        return lines
+
+    def sized_descriptions(self, lines):
+        """Returns the description for each size"""
+        return {'std': self.select_lines(lines, self.bot.settings.std_lines),
+                'max': self.select_lines(lines, self.bot.settings.max_lines)}
+
+    def select_lines(self, lines, no):
+        """Returns a description made of up to no lines"""
+        no = min(no, len(lines))
+        description = ''.join(lines[:no])
+        if len(description) > self.bot.settings.max_chars:
+            description = description[:self.bot.settings.max_chars]
+        if description.count('```') % 2 != 0:
+            description += '```'
+        if len(lines) > no:
+            description += '\n*Continued...*'
+        return description
+
+    def replace(self, message, spoilers):
+        """Replaces the content of a sent response, keeping its current size, and edits the message if it is still
+        live"""
+        if self.bot_message is None or self.bot_message.id not in self.bot.reactions.responses:
+            return
+        lines = self.get_lines(message.description, self.bot.settings.line_length)
+        self.raw_content = message.description
+        self.spoilers = spoilers
+        self.revealed = None
+        self.embed = message
+        self.descriptions = self.sized_descriptions(lines)
+        self.embed.description = self.descriptions[self.current_size]
+        self.bot.outbound.edit(self.bot_message, embed=self.embed)
+        self.add_spoiler_element()
+
+    def add_spoiler_element(self):
+        """Adds the spoiler button to a sent response once it has spoilers"""
+        if self.spoilers and 'show_spoiler' not in self.ui.element_list:
+            self.ui += 'show_spoiler'
+            self.bot.outbound.add_reactions(self.bot_message, ['🔍'])
 
     def update_size(self, size):
-        """Updates the size of the embed and rebuilds it"""
-        if self.size != size:
-            self.size = size
-            self.select_lines()
+        """Updates the size of the embed"""
+        if self.current_size != size:
+            self.current_size = size
+            self.embed.description = self.descriptions[size]
             return True
         return False
+
+
+class PagedResponse(ResizeableResponse):
+    """A resizeable response with several pages, flipped through with the previous and next elements. Pages are built
+    from their sources by render, which returns an embed and its spoilers. A page is only built when it is first shown
+    and is kept for flipping back to it."""
+    def __init__(self, user_message, bot, sources, render, **kwargs):
+        self.sources = list(sources)
+        self.render = render
+        self.pages = {}
+        self.page = 0
+        message, spoilers = self.render_page(0)
+        ResizeableResponse.__init__(self, user_message, bot, message, spoilers=spoilers,
+                                    ui_elements=['previous', 'next', 'max', 'min', 'close'], **kwargs)
+        self.pages[0] = (self.embed, self.raw_content, self.spoilers, self.descriptions)
+
+    def render_page(self, page):
+        """Builds a page's embed, noting its position in the footer"""
+        message, spoilers = self.render(self.sources[page])
+        footer = message.footer
+        message.set_footer(text=f'{footer.text or ""} ({page + 1}/{len(self.sources)})'.strip(),
+                           icon_url=footer.icon_url)
+        return message, spoilers
+
+    def show_page(self, page):
+        """Makes page the current page, building it if it hasn't been shown yet"""
+        if page not in self.pages:
+            message, spoilers = self.render_page(page)
+            lines = self.get_lines(message.description, self.bot.settings.line_length)
+            self.pages[page] = (message, message.description, spoilers, self.sized_descriptions(lines))
+        self.page = page
+        self.embed, self.raw_content, self.spoilers, self.descriptions = self.pages[page]
+        self.revealed = None
+        self.embed.description = self.descriptions[self.current_size]
+
+    def flip(self, step):
+        """Shows the page step pages on from the current one, wrapping around at either end"""
+        self.show_page((self.page + step) % len(self.sources))
+        self.bot.outbound.edit(self.bot_message, embed=self.embed)
+        self.add_spoiler_element()
+
+    def replace_page(self, page, source):
+        """Replaces the source of a page, editing the message if the page is showing and the response is still live"""
+        self.sources[page] = source
+        self.pages.pop(page, None)
+        if page == self.page and self.bot_message and self.bot_message.id in self.bot.reactions.responses:
+            self.flip(0)
@@ -0,0 +1,73 @@
+"""Micro-benchmark for the on_message pre-filter and link matching on chat sized messages. Run from the repository
+root:
+python benchmarks/bench_links.py
+Columns: the pre-filter run on every message, the bytes it allocates over all runs, the cost of a message without a
+link when on_message hands it to forum_preview without the pre-filter, and matching the link itself.
+"""
+import pathlib
+import sys
+import timeit
+import tracemalloc
+from types import SimpleNamespace
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+import forum_link  # noqa: E402
+import forum_preview  # noqa: E402
+import metrics  # noqa: E402
+import settings  # noqa: E402
+
+MESSAGES = {
+    'short chat': 'lol yeah that was the best part of the direct',
+    'long chat': 'I really think the new one is better than the last one, the combat is tighter and the story ' * 4,
+    'other link': 'have you seen this https://www.youtube.com/watch?v=dQw4w9WgXcQ it is great',
+    'era post': 'https://www.resetera.com/threads/splatoon-2-physical-is-on-sale-for-50-on-amazon.36571/#post-6834255',
+    'era posts': 'check this out https://www.resetera.com/posts/6834173/ what do you think',
+    'gaf thread': 'https://www.neogaf.com/threads/the-official-neogaf-introduce-yourself-thread.1460728/',
+    'three links': 'https://www.resetera.com/posts/6834173/ and https://www.resetera.com/threads/39971 and '
+                   'https://www.neogaf.com/threads/lebron-james-offseason-questions.1462856/#post-253285971',
+}
+
+
+def unfiltered(message, bot):
+    """Runs forum_preview for a message without a link as on_message did before the pre-filter"""
+    try:
+        forum_preview.forum_preview(message, bot).send(None)
+    except StopIteration:
+        pass
+
+
+def allocated(func, number):
+    """Returns the bytes still allocated after running func number times, less what the loop itself allocates"""
+    def traced(func):
+        func()
+        tracemalloc.start()
+        start = tracemalloc.get_traced_memory()[0]
+        for i in range(number):
+            func()
+        used = tracemalloc.get_traced_memory()[0] - start
+        tracemalloc.stop()
+        return used
+    return traced(func) - traced(lambda: None)
+
+
+def main(number=100000):
+    bot_settings = SimpleNamespace(sites=settings.load_sites(), auth_link='')
+    bot_settings.link_matcher = forum_link.link_matcher(bot_settings.sites)
+    bot = SimpleNamespace(settings=bot_settings, metrics=metrics.registry(None))
+    matcher = bot_settings.link_matcher
+    print(f'{"message":<14}{"filter ns":>10}{"bytes":>7}{"before ns":>10}{"match us":>10}  link')
+    for name, content in MESSAGES.items():
+        message = SimpleNamespace(content=content, embeds=[])
+        prefilter = timeit.timeit(lambda: matcher.mentions_site(content), number=number)
+        prefilter_bytes = allocated(lambda: matcher.mentions_site(content), number)
+        seconds = timeit.timeit(lambda: forum_link.forum_link(message, bot_settings), number=number)
+        link = forum_link.forum_link(message, bot_settings)
+        before = '-'
+        if not link:
+            before = f'{timeit.timeit(lambda: unfiltered(message, bot), number=number) / number * 1e9:.0f}'
+        print(f'{name:<14}{prefilter / number * 1e9:10.0f}{prefilter_bytes:7}{before:>10}'
+              f'{seconds / number * 1e6:10.2f}  {link.key if link else "no link"}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+"""Measures memory held per open preview. Run from the repository root:
+python benchmarks/bench_memory.py SITE FILE [POST_ID] [COUNT]
+Compares keeping the parser and its page tree alive for the life of the preview, as the bot used to, with keeping
+only the preview record.
+"""
+import gc
+import sys
+import tracemalloc
+from types import SimpleNamespace
+
+import fixtures
+import forum_parser
+import forum_preview
+import UI
+
+
+def open_previews(text, link, count, mode):
+    """Builds count responses and returns the bytes held per response"""
+    bot = fixtures.fake_bot(partial_parse=mode != 'full tree')
+    site = bot.settings.sites[link.site]
+    options = fixtures.fake_options(partial_parse=mode != 'full tree')
+    message = SimpleNamespace(channel=None, author=SimpleNamespace(id=1))
+    kept = []
+    gc.collect()
+    tracemalloc.start()
+    start = tracemalloc.get_traced_memory()[0]
+    for i in range(count):
+        if mode == 'record':
+            preview = forum_parser.parse_post(text, link, site, options)
+        else:
+            post = forum_parser.forum_parser(link, site, options)
+            page = post.build_page(text, post.post_marker())
+            post.parse_page(page)
+            preview = post.preview()
+            kept.append((post, page))
+        embed = forum_preview.build_embed(preview, link, bot)
+        kept.append(UI.ResizeableResponse(message, bot, embed, spoilers=preview.spoilers))
+    gc.collect()
+    used = tracemalloc.get_traced_memory()[0] - start
+    tracemalloc.stop()
+    return used / count
+
+
+def main(args):
+    if len(args) < 2:
+        print(__doc__)
+        return 2
+    site, path = args[0], args[1]
+    post_id = args[2] if len(args) > 2 else None
+    count = int(args[3]) if len(args) > 3 else 200
+    with open(path, encoding='utf-8') as page:
+        text = page.read()
+    link = fixtures.fake_link(site, post_id)
+    for mode in ('full tree', 'partial tree', 'record'):
+        print(f'{mode:<14}{open_previews(text, link, count, mode) / 1000:10.1f} KB per open preview')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
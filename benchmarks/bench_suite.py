@@ -0,0 +1,123 @@
+"""Benchmarks parsing every page in the corpus and matching links in chat messages, then compares the results with
+the stored baselines. Run from the repository root:
+python benchmarks/bench_suite.py [--backend NAME] [--rounds N] [--threshold FRACTION] [--gate NAMES] [--save]
+Reports posts (or messages) per second, p50 and p99 latency and peak memory traced during one run of each case.
+Exits with status 1 if any measurement named in --gate is worse than the baseline by more than the threshold, default
+0.25. The default gate is peak_kb, which is the same on any machine. The timings in baselines.json were measured on
+one machine, gate on them with --gate peak_kb,per_sec,p50 only after saving baselines on the machine that runs the
+comparison. p99 is the second slowest of 200 rounds and moves with every time the process is descheduled, add it on a
+quiet machine. --save stores the results as the new baseline for the backend.
+"""
+import argparse
+import gc
+import json
+import pathlib
+import sys
+import time
+import tracemalloc
+
+import bench_links
+import fixtures
+import forum_link
+import forum_parser
+
+BASELINES = pathlib.Path(__file__).resolve().parent / 'baselines.json'
+NOTE = ('Timings were measured on the machine that saved them and are only gated on with --gate, peak_kb is '
+        'gated on by default. Save baselines again on the machine that compares against them.')
+# Link matching is too fast to time one call at a time, each sample is the average over a batch
+LINK_BATCH = 100
+
+
+def percentile(samples, q):
+    ordered = sorted(samples)
+    return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+
+def measure(func, rounds, batch=1):
+    """Returns per second, p50 and p99 seconds per call, and peak traced KB of one call"""
+    for i in range(max(rounds // 10, 1)):
+        func()
+    gc.collect()
+    samples = []
+    for i in range(rounds):
+        start = time.perf_counter()
+        for j in range(batch):
+            func()
+        samples.append((time.perf_counter() - start) / batch)
+    gc.collect()
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {'per_sec': len(samples) / sum(samples), 'p50': percentile(samples, 0.5), 'p99': percentile(samples, 0.99),
+            'peak_kb': peak / 1000}
+
+
+def run(backend, rounds):
+    results = {}
+    bot_settings = fixtures.fake_settings(backend)
+    options = fixtures.fake_options(backend)
+    for entry, text, link in fixtures.load_corpus():
+        site = bot_settings.sites[link.site]
+        if forum_parser.parse_post(text, link, site, options) is None:
+            raise SystemExit(f'{entry["file"]}: post not found')
+        results[f'parse {entry["file"]}'] = measure(lambda: forum_parser.parse_post(text, link, site, options), rounds)
+    for name, content in bench_links.MESSAGES.items():
+        message = fixtures.fake_message(content)
+        results[f'links {name}'] = measure(lambda: forum_link.forum_link(message, bot_settings), rounds, LINK_BATCH)
+    return results
+
+
+def regressions(result, baseline, threshold, gate):
+    """Returns the names of the gated measurements worse than the baseline by more than the threshold. Per second
+    is worse when lower, the rest when higher."""
+    worse = []
+    for name in gate:
+        if name == 'per_sec':
+            if result[name] < baseline[name] / (1 + threshold):
+                worse.append(name)
+        elif result[name] > baseline[name] * (1 + threshold):
+            worse.append(name)
+    return worse
+
+
+def main(args):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--backend', default='lxml')
+    parser.add_argument('--rounds', type=int, default=200)
+    parser.add_argument('--threshold', type=float, default=0.25)
+    parser.add_argument('--gate', default='peak_kb')
+    parser.add_argument('--save', action='store_true')
+    args = parser.parse_args(args)
+    backend = fixtures.html_parsers.get_backend(args.backend)[0]
+    results = run(backend, args.rounds)
+    baselines = {}
+    if BASELINES.exists():
+        with open(BASELINES, encoding='utf-8') as stored:
+            baselines = json.load(stored)
+    baseline = baselines.get(backend, {})
+    failed = False
+    print(f'backend {backend}, {args.rounds} rounds')
+    print(f'{"case":<30}{"per sec":>10}{"p50 us":>10}{"p99 us":>10}{"peak KB":>10}  vs baseline')
+    for case, result in results.items():
+        if case in baseline:
+            worse = regressions(result, baseline[case], args.threshold, args.gate.split(','))
+            verdict = 'REGRESSED ' + ', '.join(worse) if worse else 'ok'
+            failed = failed or bool(worse)
+        else:
+            verdict = 'no baseline'
+        print(f'{case:<30}{result["per_sec"]:10.0f}{result["p50"] * 1e6:10.1f}{result["p99"] * 1e6:10.1f}'
+              f'{result["peak_kb"]:10.1f}  {verdict}')
+    if args.save:
+        baselines[backend] = results
+        baselines['_note'] = NOTE
+        with open(BASELINES, 'w', encoding='utf-8', newline='\n') as stored:
+            json.dump(baselines, stored, indent=1, sort_keys=True)
+            stored.write('\n')
+        print(f'Saved baseline for {backend}')
+        return 0
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,225 @@
+"""Writes the benchmark corpus. The pages are synthetic: they are generated here, not saved from the forums, and only
+copy the XenForo 2 markup that site_settings.json extracts from plus enough surrounding page weight (head tags,
+navigation, sidebars, scripts) to parse like a real thread page. Output is deterministic, rerun after changing this
+file from the repository root:
+python benchmarks/corpus/generate.py
+"""
+import json
+import pathlib
+import random
+
+HERE = pathlib.Path(__file__).resolve().parent
+
+WORDS = ('the game looks great but performance on base hardware is rough and I am waiting for a patch before I buy '
+         'it honestly this thread is wild people said the same thing last year about the sequel and it turned out '
+         'fine the trailer the direct the remaster port price sale preorder digital physical edition review score '
+         'studio publisher launch delay').split()
+
+
+def sentence(rng, words=12):
+    return ' '.join(rng.choice(WORDS) for i in range(words)).capitalize() + '.'
+
+
+def paragraph(rng, sentences=4):
+    return ' '.join(sentence(rng, rng.randint(6, 20)) for i in range(sentences))
+
+
+class site_markup():
+    """Markup for one forum. Bodies are built from parts so each page can weight the features it is testing."""
+    name = ''
+    site_name = ''
+    base_url = ''
+
+    def __init__(self, rng):
+        self.rng = rng
+
+    def head(self, title):
+        rng = self.rng
+        tags = ['<meta charset="utf-8">', f'<title>{title} | {self.site_name}</title>',
+                f'<meta property="og:site_name" content="{self.site_name}">',
+                f'<meta property="og:title" content="{title}">',
+                f'<meta property="og:url" content="{self.base_url}threads/x.1/">',
+                f'<link rel="icon" href="{self.base_url}favicon.ico">',
+                f'<link rel="canonical" href="{self.base_url}threads/x.1/">']
+        for i in range(12):
+            tags.append(f'<link rel="stylesheet" href="{self.base_url}css.php?css=public%3A{i}&amp;s=1&amp;l=1">')
+        tags.append('<script>' + 'var config = {"url": "/", "csrf": "%032x"};\n' % rng.getrandbits(128) +
+                    'window.XF = window.XF || {};' * 40 + '</script>')
+        return '\n'.join(tags)
+
+    def chrome(self):
+        """Navigation and sidebar padding found on every page"""
+        nav = ''.join(f'<li class="p-navEl"><a href="{self.base_url}forums/{i}/" class="p-navEl-link">Forum {i}</a>'
+                      f'</li>' for i in range(30))
+        side = ''.join(f'<li class="block-row"><a href="{self.base_url}threads/{i}/">{sentence(self.rng, 6)}</a>'
+                       f'</li>' for i in range(25))
+        return f'<nav class="p-nav"><ul>{nav}</ul></nav>', f'<aside class="p-body-sidebar"><ul>{side}</ul></aside>'
+
+    def page(self, title, posts):
+        nav, side = self.chrome()
+        scripts = '<script>' + 'XF.ready(function () { XF.activate(document); });\n' * 200 + '</script>'
+        return (f'<!DOCTYPE html>\n<html lang="en-US"><head>\n{self.head(title)}\n</head><body>\n{nav}\n'
+                f'<div class="p-body"><div class="block-body js-replyNewMessageContainer">\n' + '\n'.join(posts) +
+                f'\n</div>{side}</div>\n{scripts}\n</body></html>\n')
+
+    def text(self):
+        return paragraph(self.rng, self.rng.randint(1, 4))
+
+    def link(self):
+        return f'<a href="https://example.com/{self.rng.getrandbits(32):x}" class="link link--external">' \
+               f'{sentence(self.rng, 3)}</a>'
+
+
+class era(site_markup):
+    name = 'era'
+    site_name = 'ResetEra'
+    base_url = 'https://www.resetera.com/'
+
+    def post(self, post_id, author, body, op=False):
+        return f'''<article class="message message--post js-post" data-author="{author}" data-content="post-{post_id}" id="js-post-{post_id}">
+ <div class="message-inner"><div class="message-cell message-cell--user">
+ <div class="message-avatar"><a class="avatar avatar--m" href="/members/{author}.{post_id % 997}/"><img src="data/avatars/m/{post_id % 97}/{post_id % 997}.jpg" alt="{author}"></a></div>
+ <h4 class="message-name"><a itemprop="name" href="/members/{author}.{post_id % 997}/" class="username">{author}</a></h4>
+ <h5 class="userTitle message-userTitle">Member</h5></div>
+ <div class="message-cell message-cell--main"><div class="message-main">
+ <header class="message-attribution"><a href="/threads/x.1/post-{post_id}"><span class="DateTime" title="Jan 0{post_id % 9 + 1}, 2019 at 10:{post_id % 60:02d} AM">Jan {post_id % 9 + 1}</span></a></header>
+ <div class="message-content"><article class="message-body js-selectToQuote"><div class="bbWrapper">{body}</div></article></div>
+ <footer class="message-footer"><div class="message-actionBar actionBar"><a href="/posts/{post_id}/react" class="actionBar-action">Like</a><a href="/posts/{post_id}/quote" class="actionBar-action">Quote</a></div></footer>
+ </div></div></div>
+</article>'''
+
+    def quote(self, author, post_id, inner):
+        return f'<div class="bbCodeBlock bbCodeBlock--expandable bbCodeQuote"><aside>' \
+               f'<div class="attribution type">{author} said: <a href="goto/post?id={post_id}">&uarr;</a></div>' \
+               f'<blockquote><div class="quote">{inner}</div><div class="quoteExpand">Click to expand...</div>' \
+               f'</blockquote></aside></div>'
+
+    def spoiler(self, inner):
+        return f'<button class="button bbCodeSpoilerButton ToggleTrigger Tooltip JsOnly">Spoiler</button>' \
+               f'<div class="SpoilerTarget bbCodeSpoilerText">{inner}</div>'
+
+    def tweet(self):
+        return f'<iframe data-s9e-mediaembed="twitter" allowfullscreen="" scrolling="no" ' \
+               f'data-s9e-lazyload-src="https://s9e.github.io/iframe/twitter.min.html#{self.rng.getrandbits(60)}">' \
+               f'</iframe>'
+
+    def video(self):
+        return f'<span data-s9e-mediaembed="youtube"><span><iframe allowfullscreen="" ' \
+               f'src="https://www.youtube.com/embed/{self.rng.getrandbits(40):x}"></iframe></span></span>'
+
+    def image(self):
+        return f'<img src="https://i.imgur.com/{self.rng.getrandbits(40):x}.jpg" class="bbImage" alt="" ' \
+               f'style="">'
+
+
+class gaf(site_markup):
+    name = 'gaf'
+    site_name = 'NeoGAF'
+    base_url = 'https://www.neogaf.com/'
+
+    def post(self, post_id, author, body, op=False):
+        op_badge = '<span class="thread-op">Thread Starter</span>' if op else ''
+        return f'''<article class="message message--post js-post" data-author="{author}" data-content="post-{post_id}" id="js-post-{post_id}">
+ <div class="message-inner"><div class="message-cell message-cell--user">{op_badge}
+ <div class="message-avatar"><a class="avatar avatar--m" href="/members/{author}.{post_id % 997}/"><img src="data/avatars/m/{post_id % 97}/{post_id % 997}.jpg" alt="{author}"></a></div>
+ <h4 class="message-name"><a itemprop="name" href="/members/{author}.{post_id % 997}/" class="username">{author}</a></h4></div>
+ <div class="message-cell message-cell--main"><div class="message-main">
+ <header class="message-attribution"><a href="/threads/x.1/post-{post_id}"><time class="u-dt" data-time="{1530000000 + post_id % 100000}">t</time></a></header>
+ <div class="message-content"><article class="message-body js-selectToQuote"><div class="bbWrapper">{body}</div></article></div>
+ <footer class="message-footer"><div class="message-actionBar actionBar"><a href="/posts/{post_id}/react" class="actionBar-action">Like</a></div></footer>
+ </div></div></div>
+</article>'''
+
+    def quote(self, author, post_id, inner):
+        return f'<div class="bbCodeBlock bbCodeBlock--expandable bbCodeBlock--quote">' \
+               f'<div class="bbCodeBlock-title"><a class="bbCodeBlock-sourceJump" href="goto/post?id={post_id}">' \
+               f'{author} said:</a></div><div class="bbCodeBlock-content">' \
+               f'<div class="bbCodeBlock-expandContent">{inner}</div>' \
+               f'<div class="bbCodeBlock-expandLink"><a>Click to expand...</a></div></div></div>'
+
+    def spoiler(self, inner):
+        return f'<div class="bbCodeBlock bbCodeBlock--spoiler"><button class="bbCodeSpoiler-button button">' \
+               f'Spoiler</button><div class="bbCodeBlock-content">{inner}</div></div>'
+
+    def tweet(self):
+        return f'<iframe data-s9e-mediaembed="twitter" ' \
+               f'src="https://s9e.github.io/iframe/twitter.min.html#{self.rng.getrandbits(60)}"></iframe>'
+
+    def video(self):
+        return f'<div class="bbMediaWrapper"><iframe src="https://www.youtube.com/embed/' \
+               f'{self.rng.getrandbits(40):x}"></iframe></div>'
+
+    def image(self):
+        smilie = '<img class="smilie" alt=":)" src="styles/smilies/smile.png">' if self.rng.random() < 0.3 else ''
+        return f'<img src="https://i.imgur.com/{self.rng.getrandbits(40):x}.jpg" class="bbImage" alt="">{smilie}'
+
+
+def nested_quote(markup, depth, first_id):
+    inner = markup.text()
+    for level in range(depth):
+        inner = markup.quote(f'user{level}', first_id + level, inner + ' ' + markup.text())
+    return inner
+
+
+def body(markup, first_id, quotes=0, depth=1, spoilers=0, tweets=0, videos=0, images=0, links=1):
+    parts = [markup.text()]
+    parts += [nested_quote(markup, depth, first_id) for i in range(quotes)]
+    parts += [markup.text() + ' ' + markup.link() for i in range(links)]
+    parts += [markup.spoiler(markup.text() + ' ' + markup.link()) for i in range(spoilers)]
+    parts += [markup.tweet() for i in range(tweets)]
+    parts += [markup.video() for i in range(videos)]
+    parts += [markup.image() for i in range(images)]
+    parts.append(markup.text())
+    return '\n'.join(parts)
+
+
+def thread_page(markup, title, first_id, count, target, **features):
+    """A page of count posts where the post at index target carries the features under test and the others are
+    ordinary chat"""
+    rng = markup.rng
+    posts = []
+    for i in range(count):
+        post_id = first_id + i
+        if i == target:
+            content = body(markup, first_id, **features)
+        else:
+            content = body(markup, first_id, quotes=int(rng.random() < 0.3), images=int(rng.random() < 0.2))
+        posts.append(markup.post(post_id, f'poster{rng.randint(1, 500)}', content, op=first_id == 1000 and i == 0))
+    return markup.page(title, posts), f'post-{first_id + target}'
+
+
+# file name: (site, title, first post id, posts on page, index of the wanted post, features of the wanted post,
+# link to the thread instead of the post)
+PAGES = {
+    'era_thread_op.html': ('era', 'Thread OP with images and a video', 1000, 20, 0,
+                           dict(images=6, videos=1, links=4), True),
+    'era_deep_page.html': ('era', 'Deep page, wanted post near the end', 6834200, 50, 47, dict(links=2), False),
+    'era_quotes.html': ('era', 'Heavy nested quotes', 7000000, 30, 12, dict(quotes=4, depth=3), False),
+    'era_spoilers.html': ('era', 'Story spoilers', 7100000, 30, 5, dict(spoilers=6, links=2), False),
+    'era_embeds.html': ('era', 'Tweets and YouTube embeds', 7200000, 30, 20, dict(tweets=4, videos=3), False),
+    'era_images.html': ('era', 'Screenshot thread', 7300000, 30, 9, dict(images=40), False),
+    'gaf_thread_op.html': ('gaf', 'Thread OP', 1000, 20, 0, dict(images=4, videos=1, links=3), True),
+    'gaf_deep_page.html': ('gaf', 'Deep page, wanted post near the end', 253285900, 50, 48, dict(links=2), False),
+    'gaf_quotes.html': ('gaf', 'Heavy nested quotes', 253300000, 30, 15, dict(quotes=4, depth=3), False),
+    'gaf_media.html': ('gaf', 'Spoilers, tweets, video and images', 253400000, 30, 7,
+                       dict(spoilers=3, tweets=2, videos=2, images=12), False),
+}
+
+
+def main():
+    manifest = []
+    for file_name, (site, title, first_id, count, target, features, thread) in PAGES.items():
+        markup = {'era': era, 'gaf': gaf}[site](random.Random(file_name))
+        text, post_id = thread_page(markup, title, first_id, count, target, **features)
+        with open(HERE / file_name, 'w', encoding='utf-8', newline='\n') as page:
+            page.write(text)
+        manifest.append({'file': file_name, 'site': site, 'post_id': None if thread else post_id,
+                         'features': sorted(features)})
+    with open(HERE / 'corpus.json', 'w', encoding='utf-8', newline='\n') as corpus:
+        json.dump({'synthetic': True, 'generator': 'benchmarks/corpus/generate.py', 'pages': manifest}, corpus,
+                  indent=2)
+        corpus.write('\n')
+
+
+if __name__ == '__main__':
+    main()
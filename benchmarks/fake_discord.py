@@ -0,0 +1,72 @@
+"""Stand-ins for Discord channels and messages that record the bot's actions instead of calling the API"""
+import asyncio
+import collections
+import itertools
+from types import SimpleNamespace
+
+
+class recorder():
+    """Counts every action made on the fake channels and keeps the bot's messages so reactions can be injected on
+    them. Latency is added to each action to stand in for the Discord API."""
+    def __init__(self, latency=0):
+        self.latency = latency
+        self.actions = collections.Counter()
+        self.ids = itertools.count(1)
+        self.sent = []
+        self.live = {}
+
+    async def act(self, name):
+        self.actions[name] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+
+class fake_channel():
+    def __init__(self, channel_id, actions):
+        self.id = channel_id
+        self.actions = actions
+
+    async def send(self, content=None, embed=None):
+        await self.actions.act('send')
+        message = fake_bot_message(next(self.actions.ids), self, embed)
+        self.actions.sent.append(message.id)
+        self.actions.live[message.id] = message
+        return message
+
+    async def delete_messages(self, messages):
+        await self.actions.act('bulk_delete')
+        for message in messages:
+            self.actions.live.pop(message.id, None)
+
+
+class fake_bot_message():
+    """A message sent by the bot"""
+    def __init__(self, message_id, channel, embed):
+        self.id = message_id
+        self.channel = channel
+        self.embed = embed
+        self.reactions = []
+
+    async def edit(self, embed=None, **kwargs):
+        await self.channel.actions.act('edit')
+        self.embed = embed
+
+    async def add_reaction(self, emoji):
+        await self.channel.actions.act('react')
+        self.reactions.append(emoji)
+
+    async def clear_reactions(self):
+        await self.channel.actions.act('clear_reactions')
+        self.reactions = []
+
+    async def remove_reaction(self, emoji, member):
+        await self.channel.actions.act('remove_reaction')
+
+    async def delete(self):
+        await self.channel.actions.act('delete')
+        self.channel.actions.live.pop(self.id, None)
+
+
+def reaction(message_id, user_id, emoji):
+    """A raw reaction add event as on_raw_reaction_add gets it"""
+    return SimpleNamespace(message_id=message_id, user_id=user_id, emoji=emoji)
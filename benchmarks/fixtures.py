@@ -0,0 +1,56 @@
+"""Stand-ins for the bot, messages and links so the parser can run offline on saved pages"""
+import json
+import pathlib
+import sys
+from types import SimpleNamespace
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+import forum_link  # noqa: E402
+import forum_parser  # noqa: E402
+import html_parsers  # noqa: E402
+import settings  # noqa: E402
+
+
+def fake_settings(backend='html.parser', partial_parse=True):
+    """Settings with the real site settings and link matcher but without Config.cfg"""
+    bot_settings = SimpleNamespace(sites=settings.load_sites(), partial_parse=partial_parse, stop_early=False,
+                                   max_chars=2000, max_lines=40, std_lines=20, line_length=44,
+                                   preview_max_links=5)
+    bot_settings.link_matcher = forum_link.link_matcher(bot_settings.sites)
+    bot_settings.parser_backend, bot_settings.parser = html_parsers.get_backend(backend)
+    return bot_settings
+
+
+def fake_bot(**kwargs):
+    return SimpleNamespace(settings=fake_settings(**kwargs), spoiler_mask='[Spoiler removed react with 🔍 to show]')
+
+
+def fake_options(backend='html.parser', partial_parse=True):
+    """Parse options as the bot would pass them to forum_parser.parse_post"""
+    name, parser = html_parsers.get_backend(backend)
+    return forum_parser.parse_options(parser, partial_parse, '[Spoiler removed react with 🔍 to show]')
+
+
+def fake_link(site, post_id=None, url=''):
+    """A parsed link to a post, or to a thread if post_id is None"""
+    return SimpleNamespace(site=site, type='post' if post_id else 'thread', post_id=post_id, thread_id=None, url=url)
+
+
+def fake_message(content, embeds=True, author_id=1, channel=None):
+    """A user's message as on_message gets it. Discord adds embeds to messages with links unless they are suppressed."""
+    return SimpleNamespace(content=content, embeds=[SimpleNamespace(type='link')] if embeds else [],
+                           author=SimpleNamespace(id=author_id, bot=False), channel=channel)
+
+
+CORPUS = pathlib.Path(__file__).resolve().parent / 'corpus'
+
+
+def load_corpus():
+    """Returns (entry, page text, link) for every page in the synthetic corpus, see corpus/corpus.json"""
+    with open(CORPUS / 'corpus.json', encoding='utf-8') as manifest:
+        entries = json.load(manifest)['pages']
+    pages = []
+    for entry in entries:
+        with open(CORPUS / entry['file'], encoding='utf-8') as page:
+            pages.append((entry, page.read(), fake_link(entry['site'], entry['post_id'])))
+    return pages
@@ -0,0 +1,270 @@
+"""Load test of the whole preview path, forum_preview through ResizeableResponse.send and UI.start, on one machine.
+Run from the repository root:
+python benchmarks/load_test.py [--messages N] [--rate PER_SEC] [--channels N] [--latency MS] [--error-rate FRACTION]
+    [--reactions PER_MESSAGE] [--repeat FRACTION] [--real-limits] ...
+A local HTTP server serves the corpus pages at ResetEra and NeoGAF shaped URLs with the given latency and rate of 503
+errors, and the bot's session is pointed at it. Discord is replaced by fake channels that record sends, edits,
+reactions and deletes. Messages with links are offered at a fixed rate whether or not the bot keeps up, reactions are
+injected on previews already sent. Reports throughput, latency percentiles and memory as open previews grow.
+Each link gets its own post id so every message is a fresh fetch and parse, --repeat reuses earlier links instead.
+Outbound Discord rate limits are lifted unless --real-limits is given.
+"""
+import argparse
+import asyncio
+import gc
+import random
+import sys
+import time
+from types import SimpleNamespace
+
+import aiohttp
+import psutil
+from aiohttp import web
+
+import fake_discord
+import fixtures
+import forum_preview
+import gr_bot
+import outbound
+import parse_pool
+
+SITES = {'era': 'https://www.resetera.com/', 'gaf': 'https://www.neogaf.com/'}
+EMOJIS = ('➕', '➖', '➕', '➖', '❓')
+
+
+class forum_server():
+    """Serves corpus pages at /SITE/threads/SLUG.NUMBER/. The slug picks the corpus page and the wanted post on it is
+    renumbered to NUMBER, so every number is a different post."""
+    def __init__(self, latency, error_rate, seed):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rng = random.Random(seed)
+        self.requests = 0
+        self.errors = 0
+        self.pages = {}
+        for entry, text, link in fixtures.load_corpus():
+            self.pages[(entry['site'], slug(entry))] = (entry, text)
+        self.runner = None
+        self.port = None
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get('/{site}/threads/{thread}/', self.handle)
+        # Thread links are matched without their trailing slash
+        app.router.add_get('/{site}/threads/{thread}', self.handle)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, '127.0.0.1', 0)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        await self.runner.cleanup()
+
+    async def handle(self, request):
+        self.requests += 1
+        if self.latency:
+            await asyncio.sleep(self.latency * self.rng.uniform(0.5, 1.5))
+        if self.rng.random() < self.error_rate:
+            self.errors += 1
+            return web.Response(status=503)
+        name, number = request.match_info['thread'].rsplit('.', 1)
+        entry, text = self.pages[(request.match_info['site'], name)]
+        if entry['post_id']:
+            text = text.replace(f'{entry["post_id"]}"', f'post-{number}"')
+        return web.Response(text=text, content_type='text/html')
+
+
+class local_session():
+    """Sends the bot's forum requests to the local server"""
+    def __init__(self, port):
+        self.session = aiohttp.ClientSession()
+        self.prefixes = {base: f'http://127.0.0.1:{port}/{site}/' for site, base in SITES.items()}
+
+    def get(self, url, **kwargs):
+        for base, local in self.prefixes.items():
+            if url.startswith(base):
+                url = local + url[len(base):]
+        return self.session.get(url, **kwargs)
+
+    async def close(self):
+        await self.session.close()
+
+
+class load_bot(gr_bot.preview_state):
+    """gr_bot's preview state built by gr_bot's own code, with the forum session pointed at the local server and
+    Discord replaced by fake channels"""
+    def __init__(self, args, session):
+        self.settings = fixtures.fake_settings(args.backend)
+        self.settings.stop_early = True
+        self.settings.auth_link = 'https://discord.invalid/'
+        self.settings.preview_deadline = args.deadline
+        self.settings.preview_refresh = False
+        self.settings.ui_lifetime = 86400
+        self.settings.ui_max_live = args.max_live
+        self.settings.ui_sweep_interval = 60
+        # Config.cfg's defaults, without the disk cache so every run starts cold
+        self.settings.page_cache_entries, self.settings.page_cache_ttl = 64, 300
+        self.settings.page_cache_bytes = 32000000
+        self.settings.preview_cache_entries, self.settings.preview_cache_ttl = 512, 600
+        self.settings.post_index_entries, self.settings.post_index_ttl = 100000, 86400
+        self.settings.unfurl_entries, self.settings.unfurl_wait = 1000, 30
+        self.settings.disk_cache = False
+        for site in self.settings.sites.values():
+            site.fetch = dict(site.fetch, max_concurrent=args.fetch_concurrency, rate=1e6, burst=1e6, backoff=0.05)
+        self.init_preview_state()
+        self.user = SimpleNamespace(id=0, bot=True)
+        self.session = session
+        self.parse_pool = parse_pool.parse_pool(args.executor, args.workers, args.queue)
+
+    def get_user(self, user_id):
+        return SimpleNamespace(id=user_id, bot=False)
+
+
+def slug(entry):
+    return entry['file'].rsplit('.', 1)[0].replace('_', '-')
+
+
+def make_messages(args, channels):
+    """Returns the user messages to send, each linking to a corpus page"""
+    rng = random.Random(args.seed)
+    entries = [entry for entry, text, link in fixtures.load_corpus()]
+    links = []
+    messages = []
+    for i in range(args.messages):
+        if links and rng.random() < args.repeat:
+            url = rng.choice(links)
+        else:
+            entry = entries[i % len(entries)]
+            number = 10000000 + i
+            url = f'{SITES[entry["site"]]}threads/{slug(entry)}.{number}/'
+            if entry['post_id']:
+                url += f'#post-{number}'
+            links.append(url)
+        messages.append(fixtures.fake_message(f'have a look {url} lol', author_id=1 + i % 50,
+                                              channel=channels[i % len(channels)]))
+    return messages
+
+
+def percentiles(samples):
+    if not samples:
+        return 'none'
+    ordered = sorted(samples)
+    pick = lambda q: ordered[min(int(q * len(ordered)), len(ordered) - 1)] * 1000
+    return f'p50 {pick(0.5):.1f}  p90 {pick(0.9):.1f}  p99 {pick(0.99):.1f}  max {ordered[-1] * 1000:.1f} ms'
+
+
+async def preview(message, bot, latencies):
+    start = time.perf_counter()
+    await forum_preview.forum_preview(message, bot)
+    latencies.append(time.perf_counter() - start)
+
+
+def reacting_user(bot, authors, message_id):
+    """Returns the user a sent message answers, so an injected reaction passes the UI's permission check and does the
+    work a real one would. Recorded when first seen so messages closed or expired since still get their author."""
+    if message_id not in authors:
+        response = bot.reactions.responses.get(message_id)
+        if response is None:
+            return None
+        authors[message_id] = next(iter(response.root.authorized_users))
+    return authors[message_id]
+
+
+async def drive(args, bot, actions, messages):
+    """Offers the messages at the given rate and injects reactions as the user each reacted message answers, returns
+    latencies and memory samples"""
+    rng = random.Random(args.seed)
+    authors = {}
+    process = psutil.Process()
+    latencies = []
+    reaction_latencies = []
+    memory = []
+    tasks = []
+    start = time.perf_counter()
+    for i, message in enumerate(messages):
+        delay = start + i / args.rate - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.ensure_future(preview(message, bot, latencies)))
+        for j in range(int(args.reactions) + (rng.random() < args.reactions % 1)):
+            if actions.sent:
+                target = rng.choice(actions.sent)
+                user_id = reacting_user(bot, authors, target) or message.author.id
+                payload = fake_discord.reaction(target, user_id, rng.choice(EMOJIS))
+                reacted = time.perf_counter()
+                await bot.reactions.dispatch(payload)
+                reaction_latencies.append(time.perf_counter() - reacted)
+        if i % args.sample == 0:
+            memory.append((i, len(latencies), len(bot.reactions), process.memory_info().rss))
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - start
+    # Parses that ran past the deadline carry on in the background, let them finish before the server goes away
+    while len(bot.outbound) or len(bot.flights):
+        await asyncio.sleep(0.05)
+    gc.collect()
+    memory.append((len(messages), len(latencies), len(bot.reactions), process.memory_info().rss))
+    return elapsed, latencies, reaction_latencies, memory
+
+
+async def main(args):
+    if not args.real_limits:
+        for name in outbound.buckets:
+            outbound.buckets[name] = (1e9, 1e9)
+    server = forum_server(args.latency / 1000, args.error_rate, args.seed)
+    await server.start()
+    session = local_session(server.port)
+    bot = load_bot(args, session)
+    bot.loop_monitor.start()
+    actions = fake_discord.recorder(args.discord_latency / 1000)
+    channels = [fake_discord.fake_channel(i, actions) for i in range(args.channels)]
+    messages = make_messages(args, channels)
+    try:
+        elapsed, latencies, reaction_latencies, memory = await drive(args, bot, actions, messages)
+    finally:
+        bot.loop_monitor.stop()
+        bot.parse_pool.shutdown()
+        await session.close()
+        await server.stop()
+    print(f'{len(messages)} messages offered at {args.rate}/s, handled in {elapsed:.2f}s, '
+          f'{len(messages) / elapsed:.0f}/s')
+    print(f'messages sent {actions.actions["send"]} (previews and help), server requests {server.requests}, '
+          f'errors {server.errors}')
+    print(f'message to preview sent  {percentiles(latencies)}')
+    print(f'reaction dispatch        {percentiles(reaction_latencies)} ({len(reaction_latencies)} reactions)')
+    print('discord actions          ' + ', '.join(f'{name} {count}' for name, count in sorted(actions.actions.items())))
+    print(f'loop lag                 {bot.loop_monitor.stats()}')
+    print('events                   ' + bot.metrics.event_summary().replace('\n', ', '))
+    print('stages p50/p99')
+    print('  ' + bot.metrics.summary().replace('\n', '\n  '))
+    print(f'{"offered":>10}{"done":>10}{"open":>10}{"RSS MB":>10}')
+    for offered, done, live, rss in memory:
+        print(f'{offered:>10}{done:>10}{live:>10}{rss / 1000000:>10.1f}')
+    return 0
+
+
+def parse_args(args):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=2000)
+    parser.add_argument('--rate', type=float, default=500, help='messages offered per second')
+    parser.add_argument('--channels', type=int, default=100)
+    parser.add_argument('--latency', type=float, default=50, help='mean forum latency in ms')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of forum requests answered with 503')
+    parser.add_argument('--discord-latency', type=float, default=0, help='added to each Discord action in ms')
+    parser.add_argument('--reactions', type=float, default=1, help='reactions injected per message')
+    parser.add_argument('--repeat', type=float, default=0.0, help='fraction of messages reusing an earlier link')
+    parser.add_argument('--real-limits', action='store_true', help="keep outbound's per channel rate limits")
+    parser.add_argument('--backend', default='lxml')
+    parser.add_argument('--executor', default='thread')
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--queue', type=int, default=32)
+    parser.add_argument('--fetch-concurrency', type=int, default=32)
+    parser.add_argument('--deadline', type=float, default=5)
+    parser.add_argument('--max-live', type=int, default=5000)
+    parser.add_argument('--sample', type=int, default=250, help='messages between memory samples')
+    parser.add_argument('--seed', type=int, default=1)
+    return parser.parse_args(args)
+
+
+if __name__ == '__main__':
+    sys.exit(asyncio.run(main(parse_args(sys.argv[1:]))))
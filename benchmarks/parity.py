@@ -0,0 +1,109 @@
+"""Checks that every installed HTML parser backend, in partial and full parse mode, produces the same preview as
+html.parser with a full parse. Run from the repository root:
+python benchmarks/parity.py SITE FILE [POST_ID] ...
+e.g. python benchmarks/parity.py era thread.html post-6834255
+python benchmarks/parity.py --corpus [--save]
+--corpus checks every corpus page against the previews recorded in corpus/expected.json instead, --save records them.
+Exits with status 1 if any output differs.
+"""
+import json
+import sys
+
+import fixtures
+import forum_parser
+import html_parsers
+
+FIELDS = ('title', 'icon', 'site_name', 'name', 'avlink', 'poster_link', 'timestamp', 'content', 'images', 'videos',
+          'spoilers')
+# Timestamps are converted to the local timezone so they aren't recorded
+RECORDED = tuple(field for field in FIELDS if field != 'timestamp')
+EXPECTED = fixtures.CORPUS / 'expected.json'
+
+
+def parse(text, link, backend, partial_parse):
+    site = fixtures.fake_settings().sites[link.site]
+    return forum_parser.parse_post(text, link, site, fixtures.fake_options(backend, partial_parse))
+
+
+def check(site, path, post_id=None):
+    """Returns a list of differences from the html.parser full parse for one saved page"""
+    with open(path, encoding='utf-8') as page:
+        text = page.read()
+    link = fixtures.fake_link(site, post_id)
+    expected = parse(text, link, 'html.parser', False)
+    if expected is None:
+        return [f'{path}: post not found by html.parser']
+    differences = []
+    for backend in html_parsers.available():
+        for partial_parse in (False, True):
+            result = parse(text, link, backend, partial_parse)
+            mode = f'{backend} {"partial" if partial_parse else "full"}'
+            if result is None:
+                differences.append(f'{path} {mode}: post not found')
+                continue
+            for field in FIELDS:
+                if getattr(result, field) != getattr(expected, field):
+                    differences.append(f'{path} {mode}: {field} differs\n'
+                                       f'  expected {getattr(expected, field)!r}\n  got      {getattr(result, field)!r}')
+    return differences
+
+
+def record(preview):
+    """Returns the recorded fields of a preview as stored in expected.json"""
+    fields = {}
+    for field in RECORDED:
+        value = getattr(preview, field)
+        fields[field] = list(value) if isinstance(value, tuple) else value
+    return fields
+
+
+def check_corpus():
+    """Returns a list of differences from the recorded previews for every corpus page, backend and parse mode"""
+    with open(EXPECTED, encoding='utf-8') as expected_file:
+        expected = json.load(expected_file)
+    differences = []
+    for entry, text, link in fixtures.load_corpus():
+        for backend in html_parsers.available():
+            for partial_parse in (False, True):
+                result = parse(text, link, backend, partial_parse)
+                mode = f'{entry["file"]} {backend} {"partial" if partial_parse else "full"}'
+                if result is None:
+                    differences.append(f'{mode}: post not found')
+                    continue
+                result = record(result)
+                for field in RECORDED:
+                    if result[field] != expected[entry['file']][field]:
+                        differences.append(f'{mode}: {field} differs\n  expected {expected[entry["file"]][field]!r}\n'
+                                           f'  got      {result[field]!r}')
+    return differences
+
+
+def save_corpus():
+    """Records the html.parser full parse of every corpus page in expected.json"""
+    expected = {entry['file']: record(parse(text, link, 'html.parser', False))
+                for entry, text, link in fixtures.load_corpus()}
+    with open(EXPECTED, 'w', encoding='utf-8') as expected_file:
+        json.dump(expected, expected_file, indent=2, ensure_ascii=False)
+        expected_file.write('\n')
+    print(f'Saved {len(expected)} previews to {EXPECTED}')
+
+
+def main(args):
+    if args and args[0] == '--corpus':
+        if '--save' in args:
+            save_corpus()
+            return 0
+        differences = check_corpus()
+    elif len(args) < 2:
+        print(__doc__)
+        return 2
+    else:
+        differences = check(args[0], args[1], args[2] if len(args) > 2 else None)
+    for difference in differences:
+        print(difference)
+    print(f'{len(differences)} differences, backends checked: {", ".join(html_parsers.available())}')
+    return 1 if differences else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
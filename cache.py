@@ -0,0 +1,76 @@
+from collections import OrderedDict
+import time
+
+
+class ttl_cache():
+    """In memory LRU cache with a time to live and an optional byte budget. Entries are evicted least recently used
+    first whenever the entry count or the byte budget is exceeded, and are dropped on lookup once they have expired.
+    With keep_stale set expired entries are kept until evicted and can still be read with stale."""
+    def __init__(self, max_entries, ttl, max_bytes=None, keep_stale=False):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.keep_stale = keep_stale
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.entries = OrderedDict()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return self.peek(key) is not None
+
+    def get(self, key):
+        """Returns the cached value for key or None, counting the lookup as a hit or a miss"""
+        value = self.peek(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.entries.move_to_end(key)
+        return value
+
+    def peek(self, key):
+        """Returns the cached value for key without touching the hit counters or the LRU order"""
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        value, size, expires = entry
+        if expires < time.monotonic():
+            if not self.keep_stale:
+                self.remove(key)
+            return None
+        return value
+
+    def stale(self, key):
+        """Returns the value for key even if it has expired, or None if it has been evicted"""
+        entry = self.entries.get(key)
+        return entry[0] if entry else None
+
+    def put(self, key, value, size=0):
+        """Stores value under key. Size is only used against the byte budget."""
+        if self.max_bytes and size > self.max_bytes:
+            return
+        self.remove(key)
+        self.entries[key] = (value, size, time.monotonic() + self.ttl)
+        self.bytes += size
+        while len(self.entries) > self.max_entries or (self.max_bytes and self.bytes > self.max_bytes):
+            self.remove(next(iter(self.entries)))
+
+    def remove(self, key):
+        entry = self.entries.pop(key, None)
+        if entry:
+            self.bytes -= entry[1]
+
+    def clear(self):
+        self.entries.clear()
+        self.bytes = 0
+
+    def stats(self):
+        """Returns a short human readable summary for the process command"""
+        text = f'{len(self.entries)} entries, {self.hits} hits, {self.misses} misses'
+        if self.max_bytes:
+            text += f', {int(self.bytes/1000)}KB'
+        return text
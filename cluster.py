@@ -0,0 +1,124 @@
+"""Runs the bot as a cluster of worker processes on one host. The shards are split into contiguous ranges, one per
+worker, and each worker is guy_robot.py connecting only its range. Workers share pages, previews and their status
+through the disk cache file. Run instead of guy_robot.py:
+python cluster.py
+"""
+import json
+import os
+import signal
+import subprocess
+import sys
+import time
+import urllib.request
+import settings
+
+# Discord allows one shard to identify every 5 seconds, later workers start once earlier ones have identified
+IDENTIFY_INTERVAL = 5.5
+# Seconds a stopping worker gets to close its connections before it is killed
+STOP_TIMEOUT = 30
+
+
+def recommended_shards(token):
+    """Asks Discord how many shards the bot should run"""
+    request = urllib.request.Request('https://discord.com/api/v10/gateway/bot',
+                                     headers={'Authorization': f'Bot {token}', 'User-Agent': 'Guy.Robot'})
+    with urllib.request.urlopen(request, timeout=10) as response:
+        return json.load(response)['shards']
+
+
+def split_shards(shard_count, processes):
+    """Returns a list of contiguous shard id ranges, one per process"""
+    processes = max(1, min(processes, shard_count))
+    size, extra = divmod(shard_count, processes)
+    ranges = []
+    start = 0
+    for i in range(processes):
+        end = start + size + (1 if i < extra else 0)
+        ranges.append(list(range(start, end)))
+        start = end
+    return ranges
+
+
+class worker():
+    def __init__(self, cluster_id, shard_ids, shard_count):
+        self.cluster_id = cluster_id
+        self.shard_ids = shard_ids
+        self.shard_count = shard_count
+        self.process = None
+        self.started = 0
+        self.restarts = 0
+        self.restart_at = None
+
+    def start(self):
+        env = dict(os.environ, GR_CLUSTER_ID=str(self.cluster_id), GR_SHARD_COUNT=str(self.shard_count),
+                   GR_SHARD_IDS=','.join(str(shard_id) for shard_id in self.shard_ids))
+        self.process = subprocess.Popen([sys.executable, 'guy_robot.py'], env=env)
+        self.started = time.monotonic()
+        print(f'Worker {self.cluster_id} started with shards {self.shard_ids} as pid {self.process.pid}')
+
+    def check(self):
+        """Restarts the worker if it has exited, waiting longer after each quick crash. The wait is a restart time
+        checked on later calls so the other workers are still watched meanwhile."""
+        if self.restart_at is None:
+            if self.process.poll() is None:
+                return
+            print(f'Worker {self.cluster_id} exited with {self.process.returncode}')
+            delay = 0
+            if time.monotonic() - self.started < 60:
+                self.restarts += 1
+                delay = min(2 ** self.restarts, 300)
+                print(f'Worker {self.cluster_id} restarts in {delay}s')
+            else:
+                self.restarts = 0
+            self.restart_at = time.monotonic() + delay
+        if time.monotonic() >= self.restart_at:
+            self.restart_at = None
+            self.start()
+
+    def stop(self):
+        if self.process and self.process.poll() is None:
+            self.process.terminate()
+
+    def wait(self):
+        """Waits for a stopped worker to exit, killing it if it takes too long"""
+        if not self.process:
+            return
+        try:
+            self.process.wait(timeout=STOP_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            print(f'Worker {self.cluster_id} did not stop, killing pid {self.process.pid}')
+            self.process.kill()
+            self.process.wait()
+
+
+def stop_cluster(signum, frame):
+    """Stops the launcher on SIGTERM the same way as on Ctrl+C, so the workers are stopped and waited for"""
+    raise KeyboardInterrupt
+
+
+def main():
+    bot_settings = settings.settings()
+    shard_count = bot_settings.cluster_shards or recommended_shards(bot_settings.token)
+    workers = [worker(i, shard_ids, shard_count)
+               for i, shard_ids in enumerate(split_shards(shard_count, bot_settings.cluster_processes))]
+    signal.signal(signal.SIGTERM, stop_cluster)
+    try:
+        for i, cluster_worker in enumerate(workers):
+            if i:
+                time.sleep(len(workers[i - 1].shard_ids) * IDENTIFY_INTERVAL)
+            cluster_worker.start()
+        while True:
+            time.sleep(5)
+            for cluster_worker in workers:
+                cluster_worker.check()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for cluster_worker in workers:
+            cluster_worker.stop()
+        for cluster_worker in workers:
+            cluster_worker.wait()
+
+
+if __name__ == '__main__':
+    main()
@@ -31,7 +31,12 @@ class meta_cog:
         text = ''
         for guild in ctx.bot.guilds:
             text += f"{guild.name}\n"
-        response = UI.CloseableResponse(ctx.message, ctx.bot, Embed(title=title, description=text))
+        message = Embed(title=title, description=text)
+        for worker, status in (await ctx.bot.cluster_status()).items():
+            shards = '\n'.join(f'Shard {shard_id}: {shard["guilds"]} servers'
+                               for shard_id, shard in sorted(status['shards'].items(), key=lambda item: int(item[0])))
+            message.add_field(name=worker.capitalize(), value=shards or 'Not connected')
+        response = UI.CloseableResponse(ctx.message, ctx.bot, message)
         await response.send()
 
     @commands.command(name='process', hidden=True)
@@ -44,6 +49,24 @@ class meta_cog:
         message = Embed(title="Bot Process info")
         message.add_field(name='PID', value=str(pid))
         message.add_field(name='RAM Usage', value=ram)
+        message.add_field(name='Page Cache', value=ctx.bot.page_cache.stats())
+        message.add_field(name='Preview Cache', value=ctx.bot.preview_cache.stats())
+        message.add_field(name='Post Index', value=ctx.bot.post_index.stats())
+        if ctx.bot.disk_cache:
+            message.add_field(name='Disk Cache', value=await ctx.bot.disk_cache.stats())
+        message.add_field(name='Parse Pool', value=ctx.bot.parse_pool.stats())
+        message.add_field(name='Loop Lag', value=ctx.bot.loop_monitor.stats())
+        for name, limiter in ctx.bot.limiters.items():
+            message.add_field(name=f'Fetches {name}', value=limiter.stats())
+        message.add_field(name='Queued Actions', value=str(len(ctx.bot.outbound)))
+        message.add_field(name='Live Previews', value=f'{len(ctx.bot.reactions)}/{ctx.bot.settings.ui_max_live}')
+        message.add_field(name='Stage Latency p50/p99', value=ctx.bot.metrics.summary(), inline=False)
+        for worker, status in (await ctx.bot.cluster_status()).items():
+            shards = '\n'.join(f'Shard {shard_id}: {shard["latency"] * 1000:.0f}ms, {shard["guilds"]} servers'
+                               for shard_id, shard in sorted(status['shards'].items(), key=lambda item: int(item[0])))
+            message.add_field(name=f'{worker.capitalize()} (PID {status["pid"]})',
+                              value=f'{int(status["rss"]/1000000)}MB, {status["live"]} live\n{shards}')
+        message.add_field(name='Events', value=ctx.bot.metrics.event_summary())
         response = UI.CloseableResponse(ctx.message, ctx.bot, message)
         await response.send()
 
@@ -0,0 +1,240 @@
+import asyncio
+import concurrent.futures
+import json
+import pickle
+import sqlite3
+import time
+import zlib
+
+# Reads only move a page's accessed time on once it is this many seconds old, so most reads don't take the write lock
+ACCESS_INTERVAL = 300
+# The running total of stored bytes is recounted every this many page writes to take in other workers' writes
+RECOUNT_WRITES = 100
+
+
+class stored_page():
+    """A page body read back from the disk cache with the validators it was served with. Bodies read only up to the
+    posts wanted at the time are stored as they are and marked incomplete."""
+    def __init__(self, text, etag, last_modified, fetched, complete):
+        self.text = text
+        self.complete = complete
+        self.etag = etag
+        self.last_modified = last_modified
+        self.fetched = fetched
+
+    def age(self):
+        return time.time() - self.fetched
+
+    def validators(self):
+        """Returns the headers that make a request for this page conditional"""
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+
+class disk_cache():
+    """Page cache kept in an SQLite file so it survives restarts. Bodies are stored compressed with their ETag and
+    Last-Modified headers, and the least recently used pages are dropped once the stored bodies exceed max_bytes.
+    All database work runs on a single background thread so the event loop is never blocked on disk. Database errors,
+    such as an unwritable path, a full disk or a lock held too long by another worker, are logged and treated as a
+    miss or a skipped write so previews carry on from the network.
+    The file is also the store shared by the worker processes of a cluster: besides pages it holds parsed previews,
+    so a post parsed by one worker is a hit for the others, the post index and each worker's shard status."""
+    def __init__(self, path, max_bytes):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.revalidated = 0
+        self.preview_hits = 0
+        self.preview_writes = 0
+        self.post_writes = 0
+        self.errors = 0
+        self.page_writes = 0
+        self.total = None
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self.db = None
+
+    async def run(self, func, *args, default=None):
+        """Runs func on the database thread, returning default if it fails with a database error"""
+        return await asyncio.get_event_loop().run_in_executor(self.executor, self.call, func, args, default)
+
+    def call(self, func, args, default):
+        try:
+            return func(*args)
+        except sqlite3.Error as e:
+            self.errors += 1
+            # The same error usually repeats on every call, only some are logged
+            if self.errors == 1 or self.errors % 1000 == 0:
+                print(f'Disk cache error ({self.errors} so far): {type(e).__name__} {e}')
+            self.total = None
+            if self.db is not None:
+                try:
+                    self.db.rollback()
+                except sqlite3.Error:
+                    pass
+            return default
+
+    def connect(self):
+        if self.db is None:
+            self.db = sqlite3.connect(self.path, check_same_thread=False)
+            self.db.execute('PRAGMA journal_mode=WAL')
+            self.db.execute('CREATE TABLE IF NOT EXISTS pages (key TEXT PRIMARY KEY, body BLOB, etag TEXT, '
+                            'last_modified TEXT, fetched REAL, accessed REAL, size INTEGER)')
+            try:
+                # Files from before incomplete bodies were stored only hold complete ones
+                self.db.execute('ALTER TABLE pages ADD COLUMN complete INTEGER DEFAULT 1')
+            except sqlite3.OperationalError:
+                pass
+            self.db.execute('CREATE INDEX IF NOT EXISTS pages_accessed ON pages (accessed)')
+            self.db.execute('CREATE TABLE IF NOT EXISTS previews (key TEXT PRIMARY KEY, preview BLOB, expires REAL)')
+            self.db.execute('CREATE TABLE IF NOT EXISTS workers (name TEXT PRIMARY KEY, status TEXT, updated REAL)')
+            self.db.execute('CREATE TABLE IF NOT EXISTS post_pages (key TEXT PRIMARY KEY, url TEXT, anchor TEXT, '
+                            'seen REAL)')
+            self.db.execute('CREATE INDEX IF NOT EXISTS post_pages_seen ON post_pages (seen)')
+        return self.db
+
+    async def get(self, key):
+        """Returns the stored page for key or None"""
+        return await self.run(self.read, key)
+
+    async def put(self, key, text, etag, last_modified, complete):
+        """Stores a page body, complete is false for a body read only up to the wanted posts"""
+        await self.run(self.write, key, text, etag, last_modified, complete)
+
+    async def refresh(self, key):
+        """Marks a stored page as just revalidated after a 304"""
+        self.revalidated += 1
+        await self.run(self.mark_fetched, key)
+
+    def read(self, key):
+        db = self.connect()
+        row = db.execute('SELECT body, etag, last_modified, fetched, complete, accessed FROM pages WHERE key = ?',
+                         (key,)).fetchone()
+        if row is None:
+            return None
+        now = time.time()
+        if now - row[5] > ACCESS_INTERVAL:
+            db.execute('UPDATE pages SET accessed = ? WHERE key = ?', (now, key))
+            db.commit()
+        self.hits += 1
+        return stored_page(zlib.decompress(row[0]).decode('utf-8'), row[1], row[2], row[3], bool(row[4]))
+
+    def write(self, key, text, etag, last_modified, complete):
+        body = zlib.compress(text.encode('utf-8'), 6)
+        if len(body) > self.max_bytes:
+            return
+        db = self.connect()
+        now = time.time()
+        replaced = db.execute('SELECT size FROM pages WHERE key = ?', (key,)).fetchone()
+        db.execute('INSERT OR REPLACE INTO pages (key, body, etag, last_modified, fetched, accessed, size, complete) '
+                   'VALUES (?, ?, ?, ?, ?, ?, ?, ?)', (key, body, etag, last_modified, now, now, len(body), complete))
+        if self.total is None or self.page_writes % RECOUNT_WRITES == 0:
+            self.total = db.execute('SELECT COALESCE(SUM(size), 0) FROM pages').fetchone()[0]
+        else:
+            self.total += len(body) - (replaced[0] if replaced else 0)
+        self.page_writes += 1
+        if self.total > self.max_bytes:
+            for old_key, size in db.execute('SELECT key, size FROM pages ORDER BY accessed').fetchall():
+                db.execute('DELETE FROM pages WHERE key = ?', (old_key,))
+                self.total -= size
+                if self.total <= self.max_bytes:
+                    break
+        db.commit()
+
+    def mark_fetched(self, key):
+        db = self.connect()
+        now = time.time()
+        db.execute('UPDATE pages SET fetched = ?, accessed = ? WHERE key = ?', (now, now, key))
+        db.commit()
+
+    async def get_preview(self, key):
+        """Returns the preview another worker, or this one before a restart, stored for key, or None"""
+        return await self.run(self.read_preview, '/'.join(key))
+
+    async def put_preview(self, key, preview, ttl):
+        await self.run(self.write_preview, '/'.join(key), preview, ttl)
+
+    async def put_status(self, name, status):
+        """Stores a worker's status for the owner's stats commands"""
+        await self.run(self.write_status, name, status)
+
+    async def statuses(self, max_age):
+        """Returns the status of every worker that reported within max_age seconds, by worker name"""
+        return await self.run(self.read_statuses, max_age, default={})
+
+    async def get_post_page(self, key):
+        """Returns the stored (page url, anchor) of a post, or None"""
+        return await self.run(self.read_post_page, key)
+
+    async def put_post_pages(self, posts, max_posts):
+        """Stores (page url, anchor) by post, dropping the posts seen longest ago beyond max_posts"""
+        await self.run(self.write_post_pages, posts, max_posts)
+
+    def read_post_page(self, key):
+        row = self.connect().execute('SELECT url, anchor FROM post_pages WHERE key = ?', (key,)).fetchone()
+        return tuple(row) if row else None
+
+    def write_post_pages(self, posts, max_posts):
+        db = self.connect()
+        now = time.time()
+        db.executemany('INSERT OR REPLACE INTO post_pages VALUES (?, ?, ?, ?)',
+                       [(key, url, anchor, now) for key, (url, anchor) in posts.items()])
+        self.post_writes += 1
+        # Counting is a table scan, the limit is only enforced every 50 pages
+        if self.post_writes % 50 == 0:
+            count = db.execute('SELECT COUNT(*) FROM post_pages').fetchone()[0]
+            if count > max_posts:
+                db.execute('DELETE FROM post_pages WHERE key IN (SELECT key FROM post_pages ORDER BY seen LIMIT ?)',
+                           (count - max_posts,))
+        db.commit()
+
+    def read_preview(self, key):
+        row = self.connect().execute('SELECT preview FROM previews WHERE key = ? AND expires > ?',
+                                     (key, time.time())).fetchone()
+        if row is None:
+            return None
+        self.preview_hits += 1
+        return pickle.loads(row[0])
+
+    def write_preview(self, key, preview, ttl):
+        db = self.connect()
+        db.execute('INSERT OR REPLACE INTO previews VALUES (?, ?, ?)',
+                   (key, pickle.dumps(preview, pickle.HIGHEST_PROTOCOL), time.time() + ttl))
+        self.preview_writes += 1
+        if self.preview_writes % 100 == 0:
+            db.execute('DELETE FROM previews WHERE expires < ?', (time.time(),))
+        db.commit()
+
+    def write_status(self, name, status):
+        db = self.connect()
+        db.execute('INSERT OR REPLACE INTO workers VALUES (?, ?, ?)', (name, json.dumps(status), time.time()))
+        db.commit()
+
+    def read_statuses(self, max_age):
+        rows = self.connect().execute('SELECT name, status FROM workers WHERE updated > ? ORDER BY name',
+                                      (time.time() - max_age,)).fetchall()
+        return {name: json.loads(status) for name, status in rows}
+
+    def summary(self):
+        row = self.connect().execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM pages').fetchone()
+        return row[0], row[1]
+
+    async def stats(self):
+        """Returns a short human readable summary for the process command"""
+        count, size = await self.run(self.summary, default=(0, 0))
+        text = f'{count} pages, {int(size/1000)}KB, {self.hits} hits, {self.revalidated} revalidated, ' \
+               f'{self.preview_hits} shared preview hits'
+        if self.errors:
+            text += f', {self.errors} errors'
+        return text
+
+    def close(self):
+        def close_db():
+            if self.db:
+                self.db.close()
+                self.db = None
+        self.executor.submit(close_db)
+        self.executor.shutdown(wait=True)
@@ -0,0 +1,91 @@
+import re
+
+# Actions that record a value from the first matching element and let the walk carry on into it. Any other action
+# takes over the element.
+field_actions = ('author', 'avatar', 'time', 'content')
+
+
+class rule():
+    """A rule from a site's extraction plan. Matches elements by tag name and optionally by class, class pattern and
+    attributes. A class matches if it is one of the element's classes or the element's whole class attribute, a class
+    pattern is searched for in the same way. An attribute value of true only requires the attribute to be present.
+    Any other keys are options for the rule's action."""
+    def __init__(self, index, data):
+        self.index = index
+        self.action = data['action']
+        self.tag = data['tag']
+        self.css_class = data.get('class')
+        self.class_pattern = re.compile(data['class_pattern']) if 'class_pattern' in data else None
+        self.attrs = data.get('attrs', {})
+        self.options = data
+
+    def __repr__(self):
+        return f'{self.action} {self.tag} {self.css_class or ""}'.strip()
+
+    def matches(self, tag):
+        for name, value in self.attrs.items():
+            if value is True:
+                if not tag.has_attr(name):
+                    return False
+            elif tag.get(name) != value:
+                return False
+        if self.css_class or self.class_pattern:
+            classes = tag.get('class') or []
+            joined = ' '.join(classes)
+            if self.css_class and self.css_class not in classes and self.css_class != joined:
+                return False
+            if self.class_pattern and not self.class_pattern.search(joined) and \
+                    not any(self.class_pattern.search(css_class) for css_class in classes):
+                return False
+        return True
+
+
+class extraction_plan():
+    """A site's extraction section from site_settings.json compiled for lookup by tag name.
+    marker: text found only in the opening tag of the wanted post, by link type. Used to slice the post out of a page.
+    post: how to find the post on the page, by link type. A tag with optional class and attrs, parents moves up from
+    the element found.
+    rules: element rules applied in a single walk over the post. Field rules are all applied, of the remaining rules
+    the first matching rule is applied. Marker and post attrs can include {post_id} and {thread_id}."""
+    def __init__(self, data):
+        self.markers = data.get('marker', {})
+        # Every post's marker on a page, used to learn which page each post is on
+        self.anchor_pattern = None
+        if 'post' in self.markers:
+            template = re.escape(self.markers['post']).replace(re.escape('{post_id}'), r'(post-\d+)')
+            self.anchor_pattern = re.compile(template.replace(re.escape('{thread_id}'), r'\d+'))
+        self.posts = data['post']
+        self.fields = {}
+        self.actions = {}
+        for index, item in enumerate(data['rules']):
+            new_rule = rule(index, item)
+            rules = self.fields if new_rule.action in field_actions else self.actions
+            rules.setdefault(new_rule.tag, []).append(new_rule)
+
+    def marker(self, link):
+        """Returns text that only appears in the wanted post's opening tag, or None if the post can't be found that way"""
+        marker = self.markers.get(link.type)
+        if marker:
+            return marker.format(post_id=link.post_id, thread_id=link.thread_id)
+        return None
+
+    def anchors(self, text):
+        """Returns the ids of the posts on a page, in the form post-N"""
+        if self.anchor_pattern is None:
+            return []
+        return self.anchor_pattern.findall(text)
+
+    def find_post(self, page, link):
+        """Returns the wanted post from a parsed page, or None"""
+        spec = self.posts[link.type]
+        attrs = {}
+        for name, value in spec.get('attrs', {}).items():
+            attrs[name] = value.format(post_id=link.post_id, thread_id=link.thread_id) if isinstance(value, str) \
+                else value
+        if 'class' in spec:
+            attrs['class'] = spec['class']
+        post = page.find(spec['tag'], attrs=attrs)
+        for i in range(spec.get('parents', 0)):
+            if post:
+                post = post.parent
+        return post
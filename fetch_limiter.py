@@ -0,0 +1,100 @@
+import asyncio
+import time
+import rate_limit
+
+
+class site_unavailable(Exception):
+    """Raised instead of fetching while a site's circuit breaker is open"""
+    pass
+
+
+class site_limiter():
+    """Limits fetches from one site: at most max_concurrent at once, started at rate per second with bursts of up to
+    burst. 429 and server errors back the site off exponentially from backoff up to max_backoff seconds, or for as long
+    as Retry-After asks. After failure_threshold failures in a row the breaker opens and fetches fail fast for
+    reset_timeout seconds, then a single trial fetch decides whether it closes again. Used as an async context manager
+    around each request, whose outcome is reported with success or failure."""
+    def __init__(self, name, config):
+        self.name = name
+        self.config = config
+        self.max_concurrent = config.get('max_concurrent', 4)
+        self.retries = config.get('retries', 1)
+        self.backoff = config.get('backoff', 1)
+        self.max_backoff = config.get('max_backoff', 60)
+        self.failure_threshold = config.get('failure_threshold', 5)
+        self.reset_timeout = config.get('reset_timeout', 30)
+        self.bucket = rate_limit.token_bucket(config.get('rate', 5), config.get('burst', 10))
+        self.slots = asyncio.Semaphore(self.max_concurrent)
+        self.waiting = 0
+        self.active = 0
+        self.failures = 0
+        self.backoff_until = 0
+        self.state = 'closed'
+        self.opened = 0
+        # The task making the half-open trial fetch
+        self.trial = None
+
+    async def __aenter__(self):
+        if not self.allow():
+            raise site_unavailable(self.name)
+        self.waiting += 1
+        try:
+            await self.slots.acquire()
+            try:
+                delay = self.backoff_until - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                await self.bucket.acquire()
+            except BaseException:
+                self.slots.release()
+                raise
+        except BaseException:
+            # A trial cancelled before it was made would otherwise keep the breaker half-open with no trial to end it
+            self.end_trial()
+            raise
+        finally:
+            self.waiting -= 1
+        self.active += 1
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.active -= 1
+        self.end_trial()
+        self.slots.release()
+
+    def allow(self):
+        """Returns whether a fetch may be made, letting one trial through once an open breaker has waited out its
+        reset timeout"""
+        if self.state == 'open':
+            if time.monotonic() - self.opened < self.reset_timeout:
+                return False
+            self.state = 'half-open'
+        if self.state == 'half-open':
+            if self.trial:
+                return False
+            self.trial = asyncio.current_task()
+        return True
+
+    def end_trial(self):
+        """Frees the trial slot if the current task holds it. Fetches let in before the breaker opened leave it be."""
+        if self.trial is asyncio.current_task():
+            self.trial = None
+
+    def success(self):
+        self.failures = 0
+        self.backoff_until = 0
+        self.state = 'closed'
+
+    def failure(self, retry_after=None):
+        self.failures += 1
+        delay = min(self.backoff * 2 ** (self.failures - 1), self.max_backoff)
+        if retry_after:
+            delay = max(delay, retry_after)
+        self.backoff_until = time.monotonic() + delay
+        if self.state == 'half-open' or self.failures >= self.failure_threshold:
+            self.state = 'open'
+            self.opened = time.monotonic()
+
+    def stats(self):
+        """Returns a short human readable summary for the process command"""
+        return f'{self.state}, {self.active} active, {self.waiting} waiting, {self.failures} failures'
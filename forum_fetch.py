@@ -0,0 +1,147 @@
+import asyncio
+import codecs
+import time
+import aiohttp
+import fetch_limiter
+import forum_parser
+
+
+def page_key(url):
+    """Returns the canonical form of a page URL used as the page cache key"""
+    return url.split('#', 1)[0].rstrip('/')
+
+
+class cached_page:
+    """Page text kept in the page cache. Pages read only up to a wanted post are marked incomplete."""
+    def __init__(self, text, complete):
+        self.text = text
+        self.complete = complete
+
+    def has(self, marker):
+        """Returns true if the post identified by marker can be taken from this page"""
+        return self.complete or (marker is not None and forum_parser.article_bounds(self.text, marker) is not None)
+
+
+async def get_page(link, marker, bot):
+    """Gets the page for a link, reusing page text from the page cache where possible. Concurrent requests for the
+    same page share a single fetch. Marker identifies the wanted post, see forum_parser.forum_parser.post_marker.
+    Posts in the post index are fetched from the page they were last seen on instead of the linked URL."""
+    indexed = None
+    if link.type == 'post' and marker:
+        indexed = await bot.post_index.get(link.site, link.post_id)
+    if indexed:
+        page = await load_page(link, indexed[0], marker, bot)
+        if page and forum_parser.article_bounds(page.text, marker) is not None:
+            return page
+        # Deleted posts move later posts back a page, the link itself still leads to the post
+        bot.post_index.forget(link.site, link.post_id)
+    return await load_page(link, link.url, marker, bot)
+
+
+async def load_page(link, url, marker, bot):
+    """Gets a page from the page cache or downloads it. Concurrent requests for posts on one page share a download that
+    reads on until every wanted post has been read. A page already cut short for another post is read whole, a page
+    linked for more than one post is likely to be linked for more."""
+    key = page_key(url)
+    page = bot.page_cache.get(key)
+    while page is None or not page.has(marker):
+        wanted = bot.wanted_posts.setdefault(key, set())
+        wanted.add(marker if page is None else None)
+        try:
+            page = await bot.flights.run(('page', key), fetch_page, link, url, key, wanted, bot)
+        finally:
+            if bot.wanted_posts.get(key) is wanted:
+                del bot.wanted_posts[key]
+        # A post joining a download that had already stopped gets the page read whole next time round. A page still
+        # incomplete after that is a stored page served while the site is unavailable.
+        if page is None or page.complete or None in wanted:
+            break
+    return page
+
+
+async def fetch_page(link, url, key, wanted, bot):
+    """Downloads the forum page through the site's fetch limiter and adds it to the page cache. Pages in the disk
+    cache that hold every wanted post are used as they are while fresh, otherwise the request is made conditional on
+    the stored validators and the stored body is reused on a 304. 429 and server errors are retried as the limiter
+    allows. In partial mode with stop_early set the download stops as soon as every wanted post has been read, wanted
+    can grow while it runs. Bodies cut short are written to disk too, marked incomplete, as with stop_early on that is
+    nearly every page."""
+    stored = await bot.disk_cache.get(key) if bot.disk_cache else None
+    covers = stored and all(cached_page(stored.text, stored.complete).has(marker) for marker in wanted)
+    if covers and stored.age() < bot.settings.disk_cache_fresh:
+        return remember(bot, key, None, cached_page(stored.text, stored.complete))
+    # A 304 would only confirm a stored body that is missing a wanted post
+    headers = stored.validators() if covers else {}
+    limiter = bot.site_limiter(link.site)
+    for attempt in range(limiter.retries + 1):
+        waiting = time.perf_counter()
+        try:
+            async with limiter:
+                bot.metrics.observe('fetch_wait', time.perf_counter() - waiting, link.site)
+                with bot.metrics.span('fetch', link.site):
+                    async with bot.session.get(url, headers=headers) as response:
+                        if response.status == 429 or response.status >= 500:
+                            bot.metrics.count('http_error', link.site, status=response.status)
+                            limiter.failure(retry_after(response))
+                            continue
+                        limiter.success()
+                        final_key = page_key(str(response.url))
+                        if response.status == 304 and covers:
+                            await bot.disk_cache.refresh(key)
+                            return remember(bot, key, final_key, cached_page(stored.text, stored.complete))
+                        if response.status == 200:
+                            if bot.settings.partial_parse and bot.settings.stop_early and None not in wanted:
+                                text, complete = await read_until(response, wanted)
+                            else:
+                                text, complete = await response.text(), True
+                            # Only a /posts/N redirect says which page the linked post is on, the rest is anchors
+                            plan = bot.settings.sites[link.site].plan
+                            bot.post_index.learn(link.site, str(response.url), text, plan,
+                                                 link.post_id if response.history else None)
+                            if bot.disk_cache:
+                                await bot.disk_cache.put(key, text, response.headers.get('ETag'),
+                                                         response.headers.get('Last-Modified'), complete)
+                            return remember(bot, key, final_key, cached_page(text, complete))
+                        bot.metrics.count('http_error', link.site, status=response.status)
+                        return None
+        except fetch_limiter.site_unavailable:
+            bot.metrics.count('breaker_rejected', link.site)
+            if stored:
+                return remember(bot, key, None, cached_page(stored.text, stored.complete))
+            print(f'Not fetching {url}, {link.site} is unavailable')
+            return None
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            print(f'Error fetching {url}: {type(e).__name__} {e}')
+            limiter.failure()
+    return None
+
+
+def remember(bot, key, final_key, page):
+    """Adds a page to the page cache and returns it. Redirected links are also cached under the page they landed on."""
+    bot.page_cache.put(key, page, len(page.text))
+    if final_key and final_key != key:
+        bot.page_cache.put(final_key, page, len(page.text))
+    return page
+
+
+def retry_after(response):
+    """Returns the Retry-After header in seconds, if it is given in seconds"""
+    try:
+        return float(response.headers.get('Retry-After'))
+    except (TypeError, ValueError):
+        return None
+
+
+async def read_until(response, markers):
+    """Reads the response until the articles containing each of markers have closed, or to the end if markers comes to
+    hold None. Returns the text up to the end of the last of those articles and whether the whole page was read."""
+    decoder = codecs.getincrementaldecoder(response.charset or 'utf-8')(errors='replace')
+    text = ''
+    async for chunk in response.content.iter_chunked(65536):
+        text += decoder.decode(chunk)
+        if None in markers:
+            continue
+        ends = [forum_parser.article_bounds(text, marker) for marker in list(markers)]
+        if all(ends):
+            return text[:max(bounds[1] for bounds in ends)], False
+    return text + decoder.decode(b'', final=True), True
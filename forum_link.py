@@ -1,8 +1,75 @@
+import os
 import re
+import urllib.parse
+
+
+class link_matcher():
+    """A single compiled expression matching every link format of every supported site. Built when the forum settings
+    are loaded. Each format from site_settings.json is wrapped in a named group so one scan of a message finds every
+    link along with its site and type. Formats name the post or thread number (?P<id>...).
+    The literal prefix shared by every format is pulled out in front of the alternation so the regex engine can skip
+    ahead to candidate links instead of trying every format at every position of the message."""
+    def __init__(self, sites):
+        self.groups = {}
+        formats = []
+        # Post formats come first so a post link is never matched as a link to its thread
+        for link_type in ('post', 'thread'):
+            for site in sites.values():
+                for link_format in site.forum_links.get(link_type, []):
+                    name = f'link{len(self.groups)}'
+                    self.groups[name] = (site.name, link_type)
+                    formats.append((name, link_format.replace('(?P<id>', f'(?P<{name}_id>')))
+        prefix = os.path.commonprefix([link_format for name, link_format in formats])
+        prefix = re.match(r'[^\\.^$*+?{}\[\]|()]*', prefix).group()
+        # A quantifier after the prefix applies to its last character, which has to stay with the quantifier
+        while prefix and any(link_format[len(prefix):len(prefix) + 1] in ('?', '*', '+', '{')
+                             for name, link_format in formats):
+            prefix = prefix[:-1]
+        patterns = [f'(?P<{name}>{link_format[len(prefix):]})' for name, link_format in formats]
+        self.expression = re.compile(prefix + '(?:' + '|'.join(patterns) + ')')
+        hosts = sorted({urllib.parse.urlsplit(site.base_url).netloc for site in sites.values()})
+        host_prefix = os.path.commonprefix(hosts)
+        self.host_scan = re.compile(re.escape(host_prefix) + '(?:' +
+                                    '|'.join(re.escape(host[len(host_prefix):]) for host in hosts) + ')').search
+
+    def mentions_site(self, content):
+        """Returns whether content mentions a supported site's host. Run on every message before anything else, it is a
+        single scan that allocates nothing for messages without a match, which is nearly all of them."""
+        return self.host_scan(content) is not None
+
+    def finditer(self, content, skip_wrapped=False):
+        """Yields (site, type, url, id) for every supported link in content. With skip_wrapped, links wrapped in <> to
+        stop Discord embedding them are left out."""
+        for match in self.expression.finditer(content):
+            if skip_wrapped and content[match.start() - 1:match.start()] == '<':
+                continue
+            name = match.lastgroup
+            site, link_type = self.groups[name]
+            yield site, link_type, match.group(), match.group(f'{name}_id')
+
+    def search(self, content):
+        """Returns (site, type, url, id) for the first supported link in content, or None"""
+        return next(self.finditer(content), None)
+
+
+def forum_links(message, settings):
+    """Returns a forum_link for each distinct post or thread linked in a message, in the order they appear, up to the
+    per message link limit. Links the user stopped Discord from embedding, by flag or by wrapping them in <>, are left
+    out before the limit so they don't use it up."""
+    flags = getattr(message, 'flags', None)
+    if getattr(flags, 'suppress_embeds', False):
+        return []
+    links = {}
+    for match in settings.link_matcher.finditer(message.content, skip_wrapped=True):
+        link = forum_link(message, settings, match)
+        links.setdefault(link.key, link)
+        if len(links) >= settings.preview_max_links:
+            break
+    return list(links.values())
 
 
 class forum_link():
-    def __init__(self, message, sites):
+    def __init__(self, message, settings, match=None):
         """Object for parsing and containing properties of links to a thread or post.
         Era links should take the forms:
         https://www.resetera.com/threads/splatoon-2-physical-is-on-sale-for-50-on-amazon.36571/
@@ -12,16 +79,18 @@ class forum_link():
         Gaf links should take the forms:
         https://www.neogaf.com/threads/lebron-james-offseason-questions.1462856/#post-253285971
         https://www.neogaf.com/threads/the-official-neogaf-introduce-yourself-thread.1460728/
+        match is a result from link_matcher.finditer, otherwise the first link in the message is used.
         """
-        self.sites = sites
-        self.message = message
         self.site = None
         self.type = None
         self.url = None
         self.post_id = None
+        self.thread_id = None
 
-        if self.check_base():
-            self.parse_link()
+        if match:
+            self.set_match(match)
+        else:
+            self.parse_link(message.content, settings.link_matcher)
 
     def __bool__(self):
         if self.url:
@@ -29,45 +98,22 @@ class forum_link():
         else:
             return False
 
-    def check_base(self):
-        """Returns true if at least one base url exists in the message"""
-        for i in self.sites:
-            if self.sites[i].base_url in self.message.content:
-                self.site = self.sites[i].name
-                return True
-        return False
-
-    def parse_link(self):
-        """Tries to find a valid link to a post or thread, as well as the post id"""
-        for key in self.sites[self.site].forum_links['post']:
-            if self.check_link(key, 'post'):
-                break
-        if not self.url:
-            for key in self.sites[self.site].forum_links['thread']:
-                if self.check_link(key, 'thread'):
-                    break
-        if not self.url:
-            print('Unable to parse link in: ' + self.message.content)
+    def parse_link(self, content, matcher):
+        """Finds the first link to a post or thread on a supported site, as well as its ID"""
+        match = matcher.search(content)
+        if match:
+            self.set_match(match)
 
-    def check_link(self, link_format, link_type):
-        """Checks the message against regex expressions for links to supported sites"""
-        p = re.compile(str(link_format))
-        m = p.search(self.message.content)
-        if m:
-            self.type = link_type
-            self.url = m.group()
-            if self.type == 'post':
-                self.get_post_id()
-            return True
-        return False
-
-    def get_post_id(self):
-        """Tries to extract the post ID from the message"""
-        if '#post-' in self.message.content:
-            self.post_id = self.message.content.split('#post-', 1)[1]
+    def set_match(self, match):
+        self.site, self.type, self.url, link_id = match
+        if self.type == 'post':
+            self.post_id = 'post-' + link_id
         else:
-            ex = re.compile('/\d+/')
-            id_match = ex.search(self.message.content)
-            self.post_id = id_match.group()
-            self.post_id = self.post_id.split('/', 2)[1]
-        self.post_id = 'post-' + self.post_id
+            self.thread_id = link_id
+
+    @property
+    def key(self):
+        """Identifies the previewed post independently of how the link was written"""
+        if self.type == 'post':
+            return self.site, self.post_id
+        return self.site, f'thread-{self.thread_id}'
@@ -1,13 +1,82 @@
-from bs4 import BeautifulSoup
-import forum_link
 import re
-import aiohttp
+import time
 from datetime import datetime
 
+article_tags = re.compile(r'<article\b|</article\s*>')
+head_tags = re.compile(r'<(?:meta|link)\b[^>]*>')
+
+
+def article_bounds(text, marker):
+    """Returns the start and end of the article containing marker, or None if the article is not complete in text.
+    Articles nest on XenForo pages so opening and closing tags are counted."""
+    position = text.find(marker)
+    if position == -1:
+        return None
+    start = text.rfind('<article', 0, position + len('<article'))
+    if start == -1:
+        return None
+    depth = 0
+    for tag in article_tags.finditer(text, start):
+        depth += -1 if tag.group().startswith('</') else 1
+        if depth == 0:
+            return start, tag.end()
+    return None
+
+
+def parse_post(text, link, site, options):
+    """Parses the linked post out of page text and returns its preview data, or None if the post wasn't found. Only
+    takes and returns picklable objects so it can run in a process pool."""
+    return timed_parse_post(text, link, site, options)[0]
+
+
+def timed_parse_post(text, link, site, options):
+    """Parses the post as parse_post does. Also returns the wall clock time parsing started, comparable across
+    processes, and the seconds spent building the tree and extracting the post from it."""
+    started = time.time()
+    post = forum_parser(link, site, options)
+    page = post.build_page(text, post.post_marker())
+    built = time.time()
+    try:
+        post.parse_page(page)
+        preview = post.preview() if post else None
+        return preview, started, built - started, time.time() - built
+    finally:
+        # Soup trees are full of reference cycles, breaking them frees the tree now instead of at the next collection
+        page.decompose()
+
+
+class parse_options:
+    """Bot settings used while parsing"""
+    def __init__(self, parser, partial_parse, spoiler_mask):
+        self.parser = parser
+        self.partial_parse = partial_parse
+        self.spoiler_mask = spoiler_mask
+
+
+class preview_data:
+    """The finished data needed to build a preview embed. Holds no references to the parsed page so it can be cached,
+    and uses slots as many are kept for the lifetime of open previews."""
+    __slots__ = ('site', 'title', 'content', 'name', 'avlink', 'poster_link', 'images', 'videos', 'spoilers',
+                 'timestamp', 'icon', 'site_name')
+
+    def __init__(self, post):
+        self.site = post.link.site
+        self.title = post.title
+        self.content = post.content
+        self.name = post.name
+        self.avlink = post.avlink
+        self.poster_link = post.poster_link
+        self.images = tuple(post.images)
+        self.videos = tuple(post.videos)
+        self.spoilers = tuple(post.spoilers)
+        self.timestamp = post.timestamp
+        self.icon = post.icon
+        self.site_name = post.site_name
+
 
 class forum_parser:
     """Parses a post and stores its data"""
-    def __init__(self, message, bot):
+    def __init__(self, link, site, options):
         self.post = None
         self.name = None
         self.avlink = None
@@ -19,11 +88,13 @@ class forum_parser:
         self.icon = None
         self.site_name = None
         self.poster_link = None
-        self.bot = bot
+        self.options = options
         self.timestamp = None
-        self.link = forum_link.forum_link(message, bot.settings.sites)
-        if self.link:
-            self.base_url = bot.settings.sites[self.link.site].base_url
+        self.link = link
+        self.base_url = site.base_url
+        self.plan = site.plan
+        self.found = {}
+        self.placeholders = []
 
     def __bool__(self):
         if self.post:
@@ -31,30 +102,30 @@ class forum_parser:
         else:
             return False
 
-    async def parse(self):
-        """Gets the page and runs all parsing operations"""
-        page = await self.get_page()
-        if page:
-            self.get_meta(page)
-            self.get_post(page)
-            if self.post:
-                self.get_name()
-                self.get_avlink()
-                self.get_time()
-                self.twitter_embed()
-                self.format_images()
-                self.youtube_embed()
-                self.format_quotes()
-                self.format_spoilers()
-                self.get_contents()
-
-    async def get_page(self):
-        """Gets the forum page"""
-        with aiohttp.ClientSession() as a_session:
-            async with a_session.get(self.link.url) as response:
-                if response.status == 200:
-                    page = BeautifulSoup(await response.text(), 'html.parser')
-                    return page
+    def parse_page(self, page):
+        """Runs all parsing operations on an already parsed page"""
+        self.get_meta(page)
+        self.get_post(page)
+        if self.post:
+            self.extract()
+
+    def preview(self):
+        """Returns the parsed post as cacheable preview data"""
+        return preview_data(self)
+
+    def post_marker(self):
+        """Returns text that only appears in the wanted post's opening tag, or None if the post can't be found that way"""
+        return self.plan.marker(self.link)
+
+    def build_page(self, text, marker):
+        """Parses the page. In partial mode only the head's meta and link tags and the wanted article are parsed, the
+        full page is parsed if the article can't be found in the text."""
+        if self.options.partial_parse and marker:
+            bounds = article_bounds(text, marker)
+            if bounds:
+                head = text[:text.find('</head>')]
+                text = ''.join(head_tags.findall(head)) + text[bounds[0]:bounds[1]]
+        return self.options.parser(text)
 
     def get_meta(self, page):
         """Gets page, icon and title from metatags, should work for all forums"""
@@ -67,141 +138,140 @@ class forum_parser:
 
     def get_post(self, page):
         """Gets a post from a page"""
-        if self.link.site == 'era':
-            if self.link.type == 'post':
-                self.post = page.find("article", id=f"js-{self.link.post_id}")
-            else:
-                self.post = page.find("article")
-        elif self.link.site == 'gaf':
-            if self.link.type == 'post':
-                self.post = page.find('article', {'data-content': self.link.post_id})
-            else:
-                self.post = page.find('span', class_='thread-op').parent.parent
+        self.post = self.plan.find_post(page, self.link)
         if not self.post:
             print(f'Error identifying post in {self.link.site} {self.link.type}: {self.link.url}')
 
-    def get_name(self):
-        poster = self.post.find("a", itemprop="name")
-        self.name = poster.get_text()
-        self.poster_link = poster['href']
+    def extract(self):
+        """Runs the site's extraction plan over the post in a single walk and gets the post text"""
+        self.found = {}
+        self.placeholders = []
+        self.walk(self.post, False)
+        for count, tag in enumerate(self.placeholders):
+            if count < len(self.images):
+                tag.replace_with(self.images[count] + '\n')
+            else:
+                tag.decompose()
+        if self.content:
+            self.content = self.content.get_text().strip()
+            self.content = re.sub('\n+', '\n', self.content)
+
+    def walk(self, tag, quoted):
+        """Visits each child element of tag. Quoted is true inside a quote, where the quote's text is kept as it is."""
+        for child in list(tag.children):
+            if child.name:
+                self.visit(child, quoted)
+
+    def visit(self, tag, quoted):
+        """Applies every matching field rule then the first matching action rule, which takes over the element.
+        Elements without an action rule are walked into."""
+        for rule in self.plan.fields.get(tag.name, ()):
+            found = self.found.get(rule.action)
+            if (found is None or rule.index < found) and rule.matches(tag):
+                self.found[rule.action] = rule.index
+                self.field_actions[rule.action](self, rule, tag)
+        for rule in self.plan.actions.get(tag.name, ()):
+            if rule.matches(tag):
+                self.actions[rule.action](self, rule, tag, quoted)
+                return
+        self.walk(tag, quoted)
+
+    # Field rules, only the first match of a rule is used. Earlier rules for the same field take precedence.
+    def get_name(self, rule, tag):
+        self.name = tag.get_text()
+        self.poster_link = tag['href']
         if self.poster_link.startswith('/'):
             self.poster_link = self.poster_link[1:]
         self.poster_link = self.base_url + self.poster_link
 
-    def get_avlink(self):
+    def get_avlink(self, rule, tag):
         """Gets the link to the poster's avatar"""
-        avlink = self.post.find('a', class_="avatar")
-        avlink = avlink.find("img")
+        avlink = tag.find("img")
         if avlink:
             self.avlink = self.base_url + avlink["src"]
             avlink.decompose()
 
-    def get_time(self):
-        timestamp = None
-        if self.post.find('span', class_="DateTime"):
-            timestamp = self.post.find('span', class_="DateTime")["title"]
-            timestamp = datetime.strptime(timestamp, '%b %d, %Y at %H:%M %p')
-        elif self.post.find('time', class_="u-dt"):
-            timestamp = datetime.fromtimestamp(int(self.post.find('time', class_="u-dt")["data-time"]))
-        if timestamp:
-            self.timestamp = timestamp.astimezone()
-
-    def get_contents(self):
-        """Gets the post text"""
-        if self.link.site == 'era':
-            self.content = self.post.find('div', class_="bbWrapper")
+    def get_time(self, rule, tag):
+        timestamp = tag[rule.options['attr']]
+        if 'format' in rule.options:
+            timestamp = datetime.strptime(timestamp, rule.options['format'])
         else:
-            self.content = self.post.find('div', class_="bbWrapper")
-        for tag in self.content.findAll('script'):
-            tag.decompose()
-        self.content = self.mark_down_links(self.content)
-        self.content = self.content.get_text().strip()
-        self.content = re.sub('\n+', '\n', self.content)
-
-    def mark_down_links(self, content):
-        """Marks down all links in a post. Runs after format quotes as to not mark down links within quotes because
-        marked down links are not supported within the code blocks the bot uses for quotes."""
-        for tag in content.findAll('a', href=True):
-            if tag.get_text() != '':
-                mark_down = f"[{tag.get_text()}]({tag['href']})"
-                tag.replace_with(mark_down)
-        return content
-
-    def format_quotes(self):
-        """"Wraps quotes in code tag for aesthetics. Adds quote attribution link where possible."""
-        if self.link.site == 'era':
-            for attribution in self.post.findAll('div', class_="attribution type"):
-                self.attribute_quote(attribution)
-            for tag in self.post.findAll('div', class_="quote"):
-                tag.replace_with(f"```{tag.get_text().strip()}```")
-            for tag in self.post.findAll('div', class_="quoteExpand"):
-                tag.decompose()
-        if self.link.site == 'gaf':
-            for tag in self.post.findAll('div', class_=re.compile('bbCodeBlock.+quote')):
-                attribution = tag.find('a', class_='bbCodeBlock-sourceJump')
-                if attribution:
-                    self.attribute_quote(attribution)
-                quote = tag.find('div', class_='bbCodeBlock-expandContent')
-                quote.replace_with(f"```{quote.get_text().strip()}```")
-                tag.find('div', class_='bbCodeBlock-expandLink').decompose()
-
-    def attribute_quote(self, tag):
-        """Gets the original poster and links to the original post if available"""
+            timestamp = datetime.fromtimestamp(int(timestamp))
+        self.timestamp = timestamp.astimezone()
+
+    def get_contents(self, rule, tag):
+        """Gets the element holding the post text, its text is taken once the walk is finished"""
+        self.content = tag
+
+    # Action rules
+    def mark_down_link(self, rule, tag, quoted):
+        """Marks down a link. Links within quotes are not marked down because marked down links are not supported within
+        the code blocks the bot uses for quotes."""
+        self.walk(tag, quoted)
+        if not quoted and tag.get_text() != '':
+            tag.replace_with(f"[{tag.get_text()}]({tag['href']})")
+
+    def format_quote(self, rule, tag, quoted):
+        """"Wraps quotes in code tag for aesthetics. Quotes within quotes are left as text."""
+        self.walk(tag, True)
+        if not quoted:
+            tag.replace_with(f"```{tag.get_text().strip()}```")
+
+    def attribute_quote(self, rule, tag, quoted):
+        """Gets the original poster and links to the original post if available. Attributions within quotes are left as
+        text, like links, as they end up in the quote's code block."""
         text = tag.get_text()
         text = text.split("said:")[0]
-        if self.link.site == 'era':
-            link = tag.find('a', href=True)['href']
-        elif self.link.site == 'gaf':
-            link = tag['href']
-        if link:
+        if 'link' in rule.options:
+            link = tag.find(rule.options['link'], href=True)
+            link = link['href'] if link else None
+        else:
+            link = tag.get('href')
+        if quoted:
+            tag.replace_with(f"{text.strip()} said:")
+        elif link:
             tag.replace_with(f"[{text} said:]({self.base_url + link})")
         else:
             tag.replace_with(f"{text} said:")
 
-    def format_images(self):
-        """Creates a list of images. Changes image tag to a URL."""
-        for tag in self.post.findAll('img', class_=re.compile("bb")):
-            self.images.append(tag["src"])
-            if self.link.site == 'era':
-                tag.replace_with(tag["src"])
-            else:
-                tag.decompose()
-        if self.link.site == 'gaf':
-            for count, tag in enumerate(self.post.findAll('img', class_="smilie")):
-                tag.replace_with(self.images[count] + '\n')
-                tag.decompose()
-
-    def format_spoilers(self):
-        for tag in self.post.findAll('div', class_="SpoilerTarget bbCodeSpoilerText"):
-            tag = self.mark_down_links(tag)
-            self.spoilers.append(tag.get_text().strip())
-            tag.replace_with(self.bot.spoiler_mask)
-        for tag in self.post.findAll('button', class_='button bbCodeSpoilerButton ToggleTrigger Tooltip JsOnly'):
+    def format_image(self, rule, tag, quoted):
+        """Adds an image to the list of images. Changes the image tag to its URL if the rule keeps images."""
+        self.images.append(tag["src"])
+        if rule.options.get('keep'):
+            tag.replace_with(tag["src"])
+        else:
             tag.decompose()
-        for tag in self.post.findAll('div', class_="bbCodeBlock bbCodeBlock--spoiler"):
-            tag = self.mark_down_links(tag)
+
+    def image_placeholder(self, rule, tag, quoted):
+        """Replaces the tag with the image of the same number once all images are known."""
+        self.placeholders.append(tag)
+
+    def format_spoiler(self, rule, tag, quoted):
+        """Adds a spoiler to the list of spoilers and masks it. Spoilers within quotes are left as text."""
+        self.walk(tag, quoted)
+        if not quoted:
             self.spoilers.append(tag.get_text().strip())
-            tag.replace_with(self.bot.spoiler_mask)
-        for tag in self.post.findAll('button', class_='bbCodeSpoiler-button button'):
-            tag.decompose()
+            tag.replace_with(self.options.spoiler_mask)
 
-    def twitter_embed(self):
+    def twitter_embed(self, rule, tag, quoted):
         """Creates a link to Twitter from a Twitter embed."""
-        for tag in self.post.findAll('iframe', attrs={'data-s9e-mediaembed': 'twitter'}):
-            if self.link.site == 'era':
-                tweet_id = tag['data-s9e-lazyload-src'].split('.html#')[1]
-            else:
-                tweet_id = tag['src'].split('.html#')[1]
-            tag.replace_with('https://twitter.com/user/status/' + tweet_id)
+        tweet_id = tag[rule.options['attr']].split('.html#')[1]
+        tag.replace_with('https://twitter.com/user/status/' + tweet_id)
 
-    def youtube_embed(self):
+    def youtube_embed(self, rule, tag, quoted):
         """Creates a link to Youtube from a youtube embed. Adds to a list of video links."""
-        tags = None
-        if self.link.site == 'era':
-            tags = self.post.findAll('span', attrs={'data-s9e-mediaembed': 'youtube'})
-        elif self.link.site == 'gaf':
-            tags = self.post.findAll('div', class_='bbMediaWrapper')
-        for tag in tags:
-            url = tag.find('iframe')['src']
-            self.videos.append(url)
-            tag.replace_with(url)
+        url = tag.find('iframe')['src']
+        self.videos.append(url)
+        tag.replace_with(url)
+
+    def remove(self, rule, tag, quoted):
+        """Removes an element. Within quotes the element is kept as part of the quote's text."""
+        if quoted:
+            self.walk(tag, quoted)
+        else:
+            tag.decompose()
+
+    field_actions = {'author': get_name, 'avatar': get_avlink, 'time': get_time, 'content': get_contents}
+    actions = {'link': mark_down_link, 'quote': format_quote, 'attribution': attribute_quote, 'image': format_image,
+               'image_placeholder': image_placeholder, 'spoiler': format_spoiler, 'tweet': twitter_embed,
+               'video': youtube_embed, 'remove': remove}
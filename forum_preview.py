@@ -1,28 +1,181 @@
+import asyncio
+import time
+from types import SimpleNamespace
 import discord
+import forum_fetch
+import forum_link
 import forum_parser
 import UI
 
 
 async def forum_preview(message, bot):
-    """Creates a preview of a forum post"""
+    """Creates a preview of the forum posts linked in a message, leaving out links the user wrapped in <>. The preview
+    is only sent once Discord has embedded the links, as an embed means previews aren't suppressed. Discord often adds
+    the embed with an edit after the message arrives, so until it does the posts are fetched and parsed ahead and the
+    message waits in bot.unfurls for the edit, see unfurled."""
+    with bot.metrics.span('link_match') as span:
+        links = forum_link.forum_links(message, bot.settings)
+        span.site = links[0].site if links else ''
+    if links:
+        if message.embeds:
+            await publish(message, links, bot)
+        else:
+            bot.unfurls.put(message.id, (message, links))
+            for link in links:
+                asyncio.ensure_future(prefetch(link, bot))
+
+
+async def unfurled(payload, bot):
+    """Handles a raw message edit, publishing the preview for a message waiting on its embed once Discord adds it. An
+    edit that changes the text replaces the waiting links with the ones now in it, or drops the message if none are."""
+    if payload.message_id not in bot.unfurls:
+        return
+    message, links = bot.unfurls.peek(payload.message_id)
+    content = payload.data.get('content')
+    if content is not None and content != message.content:
+        edited = SimpleNamespace(content=content, flags=getattr(message, 'flags', None))
+        links = forum_link.forum_links(edited, bot.settings)
+        if not links:
+            bot.unfurls.remove(payload.message_id)
+            return
+        bot.unfurls.put(payload.message_id, (message, links))
+    if payload.data.get('embeds'):
+        bot.unfurls.remove(payload.message_id)
+        bot.metrics.count('unfurled', links[0].site)
+        await publish(message, links, bot)
+
+
+async def prefetch(link, bot):
+    """Fetches and parses a post into the preview cache before it is known whether it will be previewed. Results that
+    are never published stay in the preview cache like any other preview until it evicts them."""
+    if bot.preview_cache.peek(link.key) is None:
+        bot.metrics.count('prefetch', link.site)
+        try:
+            await bot.flights.run(('preview', link.key), parse_preview, link, bot)
+        except Exception as e:
+            print(f'Error prefetching {link.url}: {type(e).__name__} {e}')
+
+
+async def publish(message, links, bot):
+    """Sends the preview of the links in a message. The links are fetched and parsed together, one response is sent
+    with a page for each post that could be previewed. Pages after the first are only built when flipped to."""
     help_text = 'This is an automatically generated preview of a forum post.\n' \
                 'The bot currently supports previews for NeoGAF.com and ResetEra.com\n' \
                 f'To add to your server have an admin accept [this link]({bot.settings.auth_link})\n' \
                 'For more information use the !gr command'
-    if message.embeds:
-        # if not embed previews are suppressed
-        post = forum_parser.forum_parser(message, bot)
-        if post.link:
-            await post.parse()
-            if post:
-                embed = discord.Embed(title=post.title, description=post.content, url=post.link.url, timestamp=post.timestamp)
-                if post.avlink:
-                    embed.set_author(name=post.name, icon_url=post.avlink, url=post.poster_link)
-                else:
-                    embed.set_author(name=post.name)
-                if post.images:
-                    embed.set_image(url=post.images[0])
-                embed.color = bot.settings.sites[post.link.site].color
-                embed.set_footer(text=post.site_name, icon_url=post.icon)
-                response = UI.ResizeableResponse(message, bot, embed, help_text=help_text, spoilers=post.spoilers)
-                await response.send()
+    results = await asyncio.gather(*[get_preview(link, bot) for link in links], return_exceptions=True)
+    sources = []
+    stale = []
+    for link, result in zip(links, results):
+        if isinstance(result, Exception):
+            print(f'Error previewing {link.url}: {type(result).__name__} {result}')
+        elif result[0]:
+            if result[1]:
+                stale.append((len(sources), link, result[0]))
+            sources.append((link, result[0]))
+    if not sources:
+        return
+    with bot.metrics.span('embed', sources[0][0].site):
+        if len(sources) == 1:
+            link, preview = sources[0]
+            response = UI.ResizeableResponse(message, bot, build_embed(preview, link, bot), help_text=help_text,
+                                             spoilers=preview.spoilers)
+        else:
+            response = UI.PagedResponse(message, bot, sources, lambda source: render_page(source, bot),
+                                        help_text=help_text)
+    await response.send()
+    if bot.settings.preview_refresh:
+        for page, link, preview in stale:
+            asyncio.ensure_future(refresh_preview(response, preview, link, bot, page if len(sources) > 1 else None))
+
+
+async def get_preview(link, bot):
+    """Gets the preview data for a link from the preview cache, or parses the post. Concurrent previews of the same
+    post wait on a single parse. If the fetch and parse take longer than the preview deadline an expired preview is
+    used instead where one is still cached, otherwise nothing is returned. Either way the parse carries on in the
+    background and caches its result. Returns the preview and whether it is stale."""
+    preview = bot.preview_cache.get(link.key)
+    if preview is not None:
+        return preview, False
+    try:
+        preview = await asyncio.wait_for(bot.flights.run(('preview', link.key), parse_preview, link, bot),
+                                         bot.settings.preview_deadline)
+        return preview, False
+    except asyncio.TimeoutError:
+        stale = bot.preview_cache.stale(link.key)
+        bot.metrics.count('deadline_stale' if stale else 'deadline_missed', link.site)
+        if stale is None:
+            print(f'Gave up on {link.url} after {bot.settings.preview_deadline}s')
+        return stale, stale is not None
+
+
+async def refresh_preview(response, stale, link, bot, page=None):
+    """Waits for the background parse of a post sent from stale data and edits the response if the post changed. page
+    is the post's page in a paged response. The parse started by get_preview is joined if it is still running, or its
+    result taken from the preview cache, a parse that has failed isn't repeated."""
+    preview = bot.preview_cache.peek(link.key)
+    if preview is None:
+        if ('preview', link.key) not in bot.flights:
+            return
+        try:
+            preview = await bot.flights.run(('preview', link.key), parse_preview, link, bot)
+        except Exception as e:
+            print(f'Error refreshing {link.url}: {type(e).__name__} {e}')
+            return
+    if preview and build_embed(preview, link, bot).to_dict() != build_embed(stale, link, bot).to_dict():
+        if page is None:
+            response.replace(build_embed(preview, link, bot), preview.spoilers)
+        else:
+            response.replace_page(page, (link, preview))
+
+
+async def parse_preview(link, bot):
+    """Fetches the page and parses the linked post in the parse pool, then caches the result. A preview stored in the
+    shared cache by another worker is used instead where there is one."""
+    if bot.disk_cache:
+        preview = await bot.disk_cache.get_preview(link.key)
+        if preview:
+            bot.preview_cache.put(link.key, preview)
+            return preview
+    site = bot.settings.sites[link.site]
+    marker = site.plan.marker(link)
+    page = await forum_fetch.get_page(link, marker, bot)
+    if page:
+        options = forum_parser.parse_options(bot.settings.parser, bot.settings.partial_parse, bot.spoiler_mask)
+        submitted = time.time()
+        try:
+            preview, started, parse_time, transform_time = await bot.parse_pool.run(
+                forum_parser.timed_parse_post, page.text, link, site, options)
+        except Exception:
+            bot.metrics.count('error', link.site, stage='parse')
+            raise
+        bot.metrics.observe('parse_wait', max(started - submitted, 0), link.site)
+        bot.metrics.observe('parse', parse_time, link.site)
+        bot.metrics.observe('transform', transform_time, link.site)
+        if preview:
+            bot.preview_cache.put(link.key, preview)
+            if bot.disk_cache:
+                await bot.disk_cache.put_preview(link.key, preview, bot.settings.preview_cache_ttl)
+        else:
+            bot.metrics.count('post_not_found', link.site)
+        return preview
+
+
+def render_page(source, bot):
+    """Builds the embed for a page of a paged response from its link and preview data"""
+    link, preview = source
+    return build_embed(preview, link, bot), preview.spoilers
+
+
+def build_embed(preview, link, bot):
+    """Builds a new embed from preview data. A new embed is built every time as responses modify their embed."""
+    embed = discord.Embed(title=preview.title, description=preview.content, url=link.url, timestamp=preview.timestamp)
+    if preview.avlink:
+        embed.set_author(name=preview.name, icon_url=preview.avlink, url=preview.poster_link)
+    else:
+        embed.set_author(name=preview.name)
+    if preview.images:
+        embed.set_image(url=preview.images[0])
+    embed.color = bot.settings.sites[preview.site].color
+    embed.set_footer(text=preview.site_name, icon_url=preview.icon)
+    return embed
@@ -1,9 +1,157 @@
 from discord.ext.commands import bot
+import asyncio
+import os
+import aiohttp
+import psutil
+import cache
+import disk_cache
+import fetch_limiter
+import forum_preview
+import metrics
+import outbound
+import parse_pool
+import post_index
 import settings
+import single_flight
+import UI
 
 
-class gr_bot(bot.Bot):
-    def __init__(self, command_prefix="!"):
-        self.settings = settings.settings()
+class preview_state():
+    """The state the preview path keeps: caches, fetch limiters, work in flight, metrics and the Discord queues. Set up
+    from the settings by init_preview_state. Mixed into gr_bot and into the load test's bot, so the load test runs the
+    bot's own components with only the network and Discord replaced."""
+    def init_preview_state(self):
         self.spoiler_mask = '[Spoiler removed react with 🔍 to show]'
-        bot.Bot.__init__(self, command_prefix=command_prefix, owner_id=self.settings.owner, case_insensitive=True)
+        self.session = None
+        self.page_cache = cache.ttl_cache(self.settings.page_cache_entries, self.settings.page_cache_ttl,
+                                          max_bytes=self.settings.page_cache_bytes)
+        self.disk_cache = None
+        if self.settings.disk_cache:
+            self.disk_cache = disk_cache.disk_cache(self.settings.disk_cache_path, self.settings.disk_cache_bytes)
+        self.post_index = post_index.post_index(self.settings.post_index_entries, self.settings.post_index_ttl,
+                                                self.disk_cache)
+        self.flights = single_flight.single_flight()
+        # Markers of the posts waiting on each page download, None for the whole page
+        self.wanted_posts = {}
+        self.unfurls = cache.ttl_cache(self.settings.unfurl_entries, self.settings.unfurl_wait)
+        self.limiters = {}
+        self.parse_pool = None
+        self.loop_monitor = metrics.loop_monitor()
+        self.metrics = metrics.registry(self)
+        self.reactions = UI.reaction_dispatcher(self)
+        self.outbound = outbound.outbound(self)
+        self.preview_cache = cache.ttl_cache(self.settings.preview_cache_entries, self.settings.preview_cache_ttl,
+                                             keep_stale=True)
+
+    def site_limiter(self, name):
+        """Returns the fetch limiter for a site, a new one is made if the site's settings have been reloaded"""
+        limiter = self.limiters.get(name)
+        config = self.settings.sites[name].fetch
+        if limiter is None or limiter.config is not config:
+            limiter = self.limiters[name] = fetch_limiter.site_limiter(name, config)
+        return limiter
+
+
+class gr_bot(preview_state, bot.AutoShardedBot):
+    """The bot. Runs every shard Discord recommends in one process, or the shards given by the cluster launcher when
+    run as one of its workers, see cluster.py."""
+    def __init__(self, command_prefix="!", shard_ids=None, shard_count=None, cluster_id=None):
+        self.settings = settings.settings()
+        self.cluster_id = cluster_id
+        self.status_task = None
+        self.init_preview_state()
+        self.exporter = None
+        if self.settings.metrics_port:
+            # Each worker of a cluster serves its metrics on the next port up
+            self.exporter = metrics.exporter(self.metrics, self.settings.metrics_host,
+                                             self.settings.metrics_port + (cluster_id or 0))
+        bot.AutoShardedBot.__init__(self, command_prefix=command_prefix, owner_id=self.settings.owner,
+                                    case_insensitive=True, shard_ids=shard_ids, shard_count=shard_count)
+
+    async def start(self, *args, **kwargs):
+        """Opens the shared HTTP session before connecting to Discord"""
+        self.session = self.create_session()
+        self.parse_pool = parse_pool.parse_pool(self.settings.parse_executor, self.settings.parse_workers,
+                                                self.settings.parse_queue)
+        self.loop_monitor.start()
+        self.reactions.start()
+        if self.exporter:
+            await self.exporter.start()
+        if self.disk_cache:
+            self.status_task = asyncio.ensure_future(self.report_status())
+        await bot.AutoShardedBot.start(self, *args, **kwargs)
+
+    async def close(self):
+        """Closes the shared HTTP session along with the Discord connection"""
+        if self.session:
+            await self.session.close()
+            self.session = None
+        if self.parse_pool:
+            self.parse_pool.shutdown()
+        if self.disk_cache:
+            self.disk_cache.close()
+        self.loop_monitor.stop()
+        self.reactions.stop()
+        if self.exporter:
+            await self.exporter.stop()
+        if self.status_task:
+            self.status_task.cancel()
+            self.status_task = None
+        await bot.AutoShardedBot.close(self)
+
+    async def on_raw_reaction_add(self, payload):
+        """Passes reactions on to the UI of the response they were added to"""
+        await self.reactions.dispatch(payload)
+
+    async def on_raw_message_edit(self, payload):
+        """Publishes previews of links that were waiting for Discord to embed them"""
+        await forum_preview.unfurled(payload, self)
+
+    @property
+    def worker_name(self):
+        return f'worker {self.cluster_id or 0}'
+
+    def shard_status(self):
+        """Returns this process's status with the latency and server count of each of its shards"""
+        guilds = {}
+        for guild in self.guilds:
+            guilds[guild.shard_id] = guilds.get(guild.shard_id, 0) + 1
+        shards = {str(shard_id): {'latency': latency, 'guilds': guilds.get(shard_id, 0)}
+                  for shard_id, latency in self.latencies}
+        return {'pid': os.getpid(), 'rss': psutil.Process().memory_info().rss, 'live': len(self.reactions),
+                'shards': shards}
+
+    async def report_status(self):
+        """Writes this process's status to the shared cache so any worker can report on the whole cluster"""
+        while True:
+            try:
+                await self.disk_cache.put_status(self.worker_name, self.shard_status())
+            except Exception as e:
+                print(f'Error reporting status: {type(e).__name__} {e}')
+            await asyncio.sleep(self.settings.status_interval)
+
+    async def cluster_status(self):
+        """Returns the status of every worker by name, only this process's when there is no shared cache"""
+        if self.disk_cache:
+            statuses = await self.disk_cache.statuses(self.settings.status_interval * 3)
+            statuses[self.worker_name] = self.shard_status()
+            return statuses
+        return {self.worker_name: self.shard_status()}
+
+    def create_session(self):
+        """Creates a pooled keep-alive session used for every forum fetch"""
+        connector = aiohttp.TCPConnector(limit=self.settings.http_pool_size,
+                                         limit_per_host=self.settings.http_per_host,
+                                         keepalive_timeout=self.settings.http_keepalive,
+                                         use_dns_cache=True, ttl_dns_cache=self.settings.http_dns_ttl)
+        timeout = aiohttp.ClientTimeout(total=self.settings.http_total_timeout,
+                                        connect=self.settings.http_connect_timeout)
+        return aiohttp.ClientSession(connector=connector, timeout=timeout)
+
+
+def worker_options(environ):
+    """Returns the shards the cluster launcher assigned to this process, nothing when the bot is run on its own"""
+    if 'GR_SHARD_IDS' not in environ:
+        return {}
+    return {'shard_ids': [int(shard_id) for shard_id in environ['GR_SHARD_IDS'].split(',')],
+            'shard_count': int(environ['GR_SHARD_COUNT']), 'cluster_id': int(environ['GR_CLUSTER_ID'])}
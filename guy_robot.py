@@ -1,10 +1,11 @@
 import forum_preview
 import discord
+import os
 import sys
 import traceback
 import gr_bot
 
-bot = gr_bot.gr_bot(command_prefix='!')
+bot = gr_bot.gr_bot(command_prefix='!', **gr_bot.worker_options(os.environ))
 
 initial_extensions = ['cogs.meta', 'cogs.cogs']
 
@@ -26,7 +27,7 @@ async def on_ready():
 
 @bot.event
 async def on_message(message):
-    if not message.author.bot:
+    if not message.author.bot and bot.settings.link_matcher.mentions_site(message.content):
         await forum_preview.forum_preview(message, bot)
     await bot.process_commands(message)
 
@@ -0,0 +1,47 @@
+from bs4 import BeautifulSoup
+import importlib
+
+
+def html_parser(text):
+    """Python's built in parser, always available but the slowest"""
+    return BeautifulSoup(text, 'html.parser')
+
+
+def lxml_parser(text):
+    """libxml2 based parser"""
+    return BeautifulSoup(text, 'lxml')
+
+
+def html5_parser(text):
+    """Gumbo based HTML5 parser from the html5-parser package, building the same tree as a browser"""
+    import html5_parser as html5
+    return html5.parse(text, treebuilder='soup', return_root=False)
+
+
+# Name: (parser, module the parser needs)
+backends = {'html.parser': (html_parser, None), 'lxml': (lxml_parser, 'lxml'),
+            'html5-parser': (html5_parser, 'html5_parser')}
+
+
+def available():
+    """Returns the names of the backends that can be used in this environment"""
+    return [name for name, (parser, module) in backends.items() if module is None or importable(module)]
+
+
+def importable(module):
+    """Returns true if module imports. Installed parsers can still fail to import, html5-parser refuses to load
+    against a different libxml2 than lxml's."""
+    try:
+        importlib.import_module(module)
+    except Exception:
+        return False
+    return True
+
+
+def get_backend(name):
+    """Returns the name and parser of the requested backend, or html.parser if it is unknown or not installed"""
+    if name not in available():
+        if name != 'html.parser':
+            print(f'HTML parser {name} is not available, using html.parser')
+        name = 'html.parser'
+    return name, backends[name][0]
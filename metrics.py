@@ -0,0 +1,193 @@
+import asyncio
+import bisect
+import time
+from aiohttp import web
+
+
+class loop_monitor():
+    """Measures event loop lag, how late a sleeping task wakes up. Lag means something is blocking the loop."""
+    def __init__(self, interval=0.5):
+        self.interval = interval
+        self.lag = 0
+        self.max_lag = 0
+        self.task = None
+
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.ensure_future(self.run())
+
+    def stop(self):
+        if self.task:
+            self.task.cancel()
+            self.task = None
+
+    async def run(self):
+        while True:
+            start = time.monotonic()
+            await asyncio.sleep(self.interval)
+            self.lag = max(time.monotonic() - start - self.interval, 0)
+            self.max_lag = max(self.max_lag, self.lag)
+
+    def stats(self):
+        """Returns a short human readable summary for the process command"""
+        return f'{self.lag * 1000:.1f}ms, max {self.max_lag * 1000:.1f}ms'
+
+
+# Upper bounds in seconds of the latency histogram buckets
+latency_buckets = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+class histogram():
+    """Counts observations into fixed latency buckets, as Prometheus histograms do"""
+    def __init__(self):
+        self.counts = [0] * (len(latency_buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(latency_buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def merge(self, other):
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.sum += other.sum
+        self.count += other.count
+
+    def quantile(self, q):
+        """Returns the upper bound of the bucket holding the q quantile, the last bucket is open so its lower bound is
+        given"""
+        wanted = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= wanted:
+                return latency_buckets[min(i, len(latency_buckets) - 1)]
+        return 0
+
+
+class span():
+    """Times a with block into a stage's histogram. The site can be set inside the block once it is known."""
+    def __init__(self, registry, stage, site):
+        self.registry = registry
+        self.stage = stage
+        self.site = site
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.registry.observe(self.stage, time.perf_counter() - self.start, self.site)
+        if exc_type is not None and not issubclass(exc_type, asyncio.CancelledError):
+            self.registry.count('error', self.site, stage=self.stage)
+
+
+class registry():
+    """Latency histograms per stage and site and event counters per site. Cache, queue and loop figures are read from
+    the bot when the metrics are rendered so they are never counted twice."""
+    def __init__(self, bot):
+        self.bot = bot
+        self.histograms = {}
+        self.counters = {}
+
+    def span(self, stage, site=''):
+        return span(self, stage, site)
+
+    def observe(self, stage, seconds, site=''):
+        key = (stage, site or '')
+        stage_histogram = self.histograms.get(key)
+        if stage_histogram is None:
+            stage_histogram = self.histograms[key] = histogram()
+        stage_histogram.observe(seconds)
+
+    def count(self, event, site='', n=1, **labels):
+        key = (event, site or '') + tuple(sorted(labels.items()))
+        self.counters[key] = self.counters.get(key, 0) + n
+
+    def stages(self):
+        """Returns each stage's histogram with all sites merged"""
+        stages = {}
+        for (stage, site), stage_histogram in self.histograms.items():
+            stages.setdefault(stage, histogram()).merge(stage_histogram)
+        return stages
+
+    def summary(self):
+        """Returns p50 and p99 latency per stage for the process command"""
+        lines = [f'{stage}: {h.quantile(0.5) * 1000:g}/{h.quantile(0.99) * 1000:g}ms ({h.count})'
+                 for stage, h in sorted(self.stages().items())]
+        return '\n'.join(lines) or 'Nothing timed yet'
+
+    def event_summary(self):
+        """Returns each event's count with all sites and labels added up for the process command"""
+        events = {}
+        for key, value in self.counters.items():
+            events[key[0]] = events.get(key[0], 0) + value
+        return '\n'.join(f'{event}: {value}' for event, value in sorted(events.items())) or 'None yet'
+
+    def render(self):
+        """Returns the metrics in the Prometheus text format"""
+        bot = self.bot
+        lines = ['# TYPE guy_robot_stage_seconds histogram']
+        for (stage, site), h in sorted(self.histograms.items()):
+            labels = f'stage="{stage}",site="{site}"'
+            seen = 0
+            for bound, count in zip(latency_buckets, h.counts):
+                seen += count
+                lines.append(f'guy_robot_stage_seconds_bucket{{{labels},le="{bound}"}} {seen}')
+            lines.append(f'guy_robot_stage_seconds_bucket{{{labels},le="+Inf"}} {h.count}')
+            lines.append(f'guy_robot_stage_seconds_sum{{{labels}}} {h.sum}')
+            lines.append(f'guy_robot_stage_seconds_count{{{labels}}} {h.count}')
+        lines.append('# TYPE guy_robot_events_total counter')
+        for key, value in sorted(self.counters.items()):
+            event, site = key[:2]
+            labels = ''.join(f',{name}="{label}"' for name, label in key[2:])
+            lines.append(f'guy_robot_events_total{{event="{event}",site="{site}"{labels}}} {value}')
+        lines.append('# TYPE guy_robot_cache_lookups_total counter')
+        caches = {'page': bot.page_cache, 'preview': bot.preview_cache}
+        for name, lookups in caches.items():
+            lines.append(f'guy_robot_cache_lookups_total{{cache="{name}",result="hit"}} {lookups.hits}')
+            lines.append(f'guy_robot_cache_lookups_total{{cache="{name}",result="miss"}} {lookups.misses}')
+        if bot.disk_cache:
+            lines.append(f'guy_robot_cache_lookups_total{{cache="disk",result="hit"}} {bot.disk_cache.hits}')
+            lines.append(f'guy_robot_cache_lookups_total{{cache="disk",result="revalidated"}} '
+                         f'{bot.disk_cache.revalidated}')
+        gauges = {'loop_lag_seconds': bot.loop_monitor.lag, 'loop_max_lag_seconds': bot.loop_monitor.max_lag,
+                  'queued_actions': len(bot.outbound), 'live_previews': len(bot.reactions),
+                  'parse_pending': bot.parse_pool.pending if bot.parse_pool else 0}
+        for name, value in gauges.items():
+            lines.append(f'# TYPE guy_robot_{name} gauge')
+            lines.append(f'guy_robot_{name} {value}')
+        lines.append('# TYPE guy_robot_fetch_waiting gauge')
+        for name, limiter in sorted(bot.limiters.items()):
+            lines.append(f'guy_robot_fetch_waiting{{site="{name}"}} {limiter.waiting}')
+        lines.append('# TYPE guy_robot_breaker_open gauge')
+        for name, limiter in sorted(bot.limiters.items()):
+            lines.append(f'guy_robot_breaker_open{{site="{name}"}} {int(limiter.state != "closed")}')
+        return '\n'.join(lines) + '\n'
+
+
+class exporter():
+    """Serves the registry's metrics at /metrics for Prometheus to scrape. Binds to localhost by default."""
+    def __init__(self, registry, host, port):
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self.runner = None
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get('/metrics', self.metrics)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, self.host, self.port).start()
+
+    async def stop(self):
+        if self.runner:
+            await self.runner.cleanup()
+            self.runner = None
+
+    async def metrics(self, request):
+        return web.Response(text=self.registry.render(), content_type='text/plain', charset='utf-8',
+                            headers={'Cache-Control': 'no-cache'})
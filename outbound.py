@@ -0,0 +1,136 @@
+import asyncio
+import itertools
+import time
+import discord
+import rate_limit
+
+# Job priorities, lower runs first. The first send of a preview goes ahead of everything else in its channel.
+SEND = 0
+EDIT = 1
+DELETE = 2
+REACT = 3
+
+# Per channel rate limits as (actions per second, burst), kept just under Discord's so requests are spaced out
+# instead of running into 429s. discord.py still handles any 429 that gets through.
+buckets = {'send': (1, 5), 'edit': (1, 5), 'delete': (5, 5), 'react': (4, 1)}
+
+
+class channel_queue():
+    """Pending Discord actions for one channel, run one at a time by priority"""
+    def __init__(self):
+        self.jobs = asyncio.PriorityQueue()
+        self.buckets = {name: rate_limit.token_bucket(*limit) for name, limit in buckets.items()}
+        self.task = None
+
+
+class outbound():
+    """Schedules the bot's Discord actions through per channel queues. Sends are run before edits, deletes and
+    reactions queued in the same channel. Repeated edits of a message that haven't run yet are collapsed into one edit
+    with the latest content, and deletes of several messages in one channel are made with a single bulk delete where
+    the bot is allowed to."""
+    def __init__(self, bot):
+        self.bot = bot
+        self.channels = {}
+        self.edits = {}
+        self.order = itertools.count()
+
+    def __len__(self):
+        """Returns the number of queued actions"""
+        return sum(queue.jobs.qsize() for queue in self.channels.values())
+
+    def submit(self, channel, priority, bucket, func, *args, **kwargs):
+        """Queues func(*args, **kwargs) in the channel's queue and returns a future for its result"""
+        queue = self.channels.get(channel.id)
+        if queue is None:
+            queue = self.channels[channel.id] = channel_queue()
+        future = asyncio.get_event_loop().create_future()
+        # Marks errors as retrieved for actions nobody waits on, the worker reports them
+        future.add_done_callback(lambda done: done.cancelled() or done.exception())
+        queue.jobs.put_nowait((priority, next(self.order), time.perf_counter(), bucket, func, args, kwargs, future))
+        if queue.task is None:
+            queue.task = asyncio.ensure_future(self.work(channel.id, queue))
+        return future
+
+    async def work(self, channel_id, queue):
+        """Runs the channel's jobs until its queue is empty"""
+        while not queue.jobs.empty():
+            job = queue.jobs.get_nowait()
+            priority, order, submitted, bucket, func, args, kwargs, future = job
+            limit = queue.buckets[bucket]
+            if not limit.try_acquire():
+                # Put back rather than hold the job so anything more urgent queued while waiting goes first
+                queue.jobs.put_nowait(job)
+                await asyncio.sleep((1 - limit.tokens) / limit.rate)
+                continue
+            self.bot.metrics.observe(f'{bucket}_wait', time.perf_counter() - submitted)
+            try:
+                with self.bot.metrics.span(bucket):
+                    result = await func(*args, **kwargs)
+                if not future.cancelled():
+                    future.set_result(result)
+            except Exception as e:
+                print(f'Discord {bucket} failed: {type(e).__name__} - {e}')
+                if not future.cancelled():
+                    future.set_exception(e)
+        queue.task = None
+        del self.channels[channel_id]
+
+    async def send(self, channel, **kwargs):
+        """Sends a message and returns it"""
+        return await self.submit(channel, SEND, 'send', channel.send, **kwargs)
+
+    def edit(self, message, **kwargs):
+        """Edits a message. Edits queued before this one runs are replaced by it. The embed is copied as it is now,
+        responses keep changing their embed while the edit waits for the rate limit."""
+        if kwargs.get('embed') is not None:
+            kwargs['embed'] = discord.Embed.from_dict(kwargs['embed'].to_dict())
+        pending = message.id in self.edits
+        self.edits[message.id] = kwargs
+        if not pending:
+            self.submit(message.channel, EDIT, 'edit', self.flush_edit, message)
+
+    async def flush_edit(self, message):
+        await message.edit(**self.edits.pop(message.id))
+
+    def add_reactions(self, message, emojis):
+        for emoji in emojis:
+            self.submit(message.channel, REACT, 'react', message.add_reaction, emoji)
+
+    def strip_reactions(self, message, emojis):
+        """Removes all reactions from a message, or only the bot's where it can't manage messages"""
+        self.submit(message.channel, REACT, 'react', self.clear_reactions, message, list(emojis))
+
+    async def clear_reactions(self, message, emojis):
+        try:
+            await message.clear_reactions()
+        except discord.HTTPException:
+            for emoji in emojis:
+                try:
+                    await message.remove_reaction(emoji, self.bot.user)
+                except discord.HTTPException:
+                    pass
+
+    def delete(self, messages):
+        """Deletes messages, in bulk for messages in the same channel"""
+        channels = {}
+        for message in messages:
+            channels.setdefault(message.channel.id, []).append(message)
+        for channel_messages in channels.values():
+            channel = channel_messages[0].channel
+            if len(channel_messages) > 1 and hasattr(channel, 'delete_messages'):
+                self.submit(channel, DELETE, 'delete', self.bulk_delete, channel, channel_messages)
+            else:
+                for message in channel_messages:
+                    self.submit(channel, DELETE, 'delete', message.delete)
+
+    @staticmethod
+    async def bulk_delete(channel, messages):
+        try:
+            await channel.delete_messages(messages)
+        except discord.HTTPException:
+            # Without Manage Messages the bot can still delete its own messages one at a time
+            for message in messages:
+                try:
+                    await message.delete()
+                except discord.NotFound:
+                    pass
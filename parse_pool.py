@@ -0,0 +1,38 @@
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import asyncio
+
+
+class parse_pool():
+    """Runs CPU bound parsing off the event loop. Kind is thread, process or inline, inline runs jobs on the event
+    loop. At most workers + queue_size jobs are accepted at once, further callers wait for a free slot. Process pool
+    jobs must be module level functions taking and returning picklable objects."""
+    def __init__(self, kind, workers, queue_size):
+        self.kind = kind
+        self.workers = workers
+        self.queue_size = queue_size
+        self.executor = None
+        if kind == 'process':
+            self.executor = ProcessPoolExecutor(workers)
+        elif kind == 'thread':
+            self.executor = ThreadPoolExecutor(workers)
+        self.slots = asyncio.Semaphore(workers + queue_size)
+        self.pending = 0
+
+    async def run(self, func, *args):
+        """Runs func(*args) in the pool and returns its result"""
+        if self.executor is None:
+            return func(*args)
+        self.pending += 1
+        try:
+            async with self.slots:
+                return await asyncio.get_event_loop().run_in_executor(self.executor, func, *args)
+        finally:
+            self.pending -= 1
+
+    def shutdown(self):
+        if self.executor:
+            self.executor.shutdown(wait=False)
+
+    def stats(self):
+        """Returns a short human readable summary for the process command"""
+        return f'{self.kind}, {self.workers} workers, {self.pending} pending'
@@ -0,0 +1,56 @@
+import asyncio
+import cache
+
+
+class post_index():
+    """Remembers which thread page each post was last seen on, learned from the anchors of every fetched page and from
+    the redirects /posts/N links go through. A link to a known post is fetched from its page directly, skipping the
+    redirect and hitting the page cache when another post on the same page was fetched first. Kept in memory as a
+    bounded LRU and, where the disk cache is on, persisted in its file so it survives restarts."""
+    def __init__(self, max_entries, ttl, store=None):
+        self.entries = cache.ttl_cache(max_entries, ttl)
+        self.max_entries = max_entries
+        self.store = store
+        self.resolved = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    async def get(self, site, post_id):
+        """Returns (page url, anchor) for a post, or None if it hasn't been seen"""
+        key = f'{site}/{post_id}'
+        page = self.entries.get(key)
+        if page is None and self.store:
+            page = await self.store.get_post_page(key)
+            if page:
+                self.entries.put(key, page)
+        if page:
+            self.resolved += 1
+        return page
+
+    def learn(self, site, url, text, plan, post_id=None):
+        """Indexes every post anchored on a page, and post_id if the page was reached by following its link"""
+        url = url.split('#', 1)[0]
+        if not plan.anchor_pattern:
+            return
+        posts = {f'{site}/{anchor}': (url, anchor) for anchor in plan.anchors(text)}
+        if post_id:
+            posts[f'{site}/{post_id}'] = (url, post_id)
+        for key, page in posts.items():
+            self.entries.put(key, page)
+        if self.store and posts:
+            asyncio.ensure_future(self.store.put_post_pages(posts, self.max_entries)).add_done_callback(self.stored)
+
+    @staticmethod
+    def stored(task):
+        """Reports a failed write to the store, nothing else waits on it"""
+        if not task.cancelled() and task.exception():
+            print(f'Error storing the post index: {type(task.exception()).__name__} {task.exception()}')
+
+    def forget(self, site, post_id):
+        """Drops a post found to have moved off its indexed page"""
+        self.entries.remove(f'{site}/{post_id}')
+
+    def stats(self):
+        """Returns a short human readable summary for the process command"""
+        return f'{len(self.entries)} posts, {self.resolved} links resolved'
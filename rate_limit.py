@@ -0,0 +1,29 @@
+import asyncio
+import time
+
+
+class token_bucket():
+    """Allows rate actions per second on average with bursts of up to capacity actions"""
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self):
+        """Takes a token if one is available and returns whether it did"""
+        self.refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    async def acquire(self):
+        """Waits until a token is available and takes it"""
+        while not self.try_acquire():
+            await asyncio.sleep((1 - self.tokens) / self.rate)
@@ -1,5 +1,8 @@
 import configparser
 import json
+import extraction
+import forum_link
+import html_parsers
 
 
 class settings():
@@ -12,7 +15,45 @@ class settings():
         self.auth_link = None
         self.token = None
         self.owner = None
+        self.http_pool_size = None
+        self.http_per_host = None
+        self.http_keepalive = None
+        self.http_dns_ttl = None
+        self.http_connect_timeout = None
+        self.http_total_timeout = None
+        self.page_cache_entries = None
+        self.page_cache_ttl = None
+        self.page_cache_bytes = None
+        self.preview_cache_entries = None
+        self.preview_cache_ttl = None
+        self.post_index_entries = None
+        self.post_index_ttl = None
+        self.disk_cache = None
+        self.disk_cache_path = None
+        self.disk_cache_bytes = None
+        self.disk_cache_fresh = None
+        self.partial_parse = None
+        self.stop_early = None
+        self.parser_backend = None
+        self.parser = None
+        self.parse_executor = None
+        self.parse_workers = None
+        self.parse_queue = None
+        self.preview_deadline = None
+        self.preview_refresh = None
+        self.unfurl_wait = None
+        self.unfurl_entries = None
+        self.preview_max_links = None
+        self.metrics_host = None
+        self.metrics_port = None
+        self.cluster_processes = None
+        self.cluster_shards = None
+        self.status_interval = None
+        self.ui_lifetime = None
+        self.ui_max_live = None
+        self.ui_sweep_interval = None
         self.sites = {}
+        self.link_matcher = None
         self.load_bot_settings()
         self.load_forum_settings()
 
@@ -26,25 +67,70 @@ class settings():
         self.auth_link = config.get('discord', 'auth_link')
         self.token = config.get('discord', 'token')
         self.owner = int(config.get('discord', 'owner'))
+        self.http_pool_size = config.getint('http', 'pool_size', fallback=100)
+        self.http_per_host = config.getint('http', 'per_host', fallback=10)
+        self.http_keepalive = config.getfloat('http', 'keepalive', fallback=30)
+        self.http_dns_ttl = config.getint('http', 'dns_ttl', fallback=300)
+        self.http_connect_timeout = config.getfloat('http', 'connect_timeout', fallback=5)
+        self.http_total_timeout = config.getfloat('http', 'total_timeout', fallback=15)
+        self.page_cache_entries = config.getint('cache', 'page_entries', fallback=64)
+        self.page_cache_ttl = config.getint('cache', 'page_ttl', fallback=300)
+        self.page_cache_bytes = config.getint('cache', 'page_bytes', fallback=32000000)
+        self.preview_cache_entries = config.getint('cache', 'preview_entries', fallback=512)
+        self.preview_cache_ttl = config.getint('cache', 'preview_ttl', fallback=600)
+        self.post_index_entries = config.getint('cache', 'post_index_entries', fallback=100000)
+        self.post_index_ttl = config.getint('cache', 'post_index_ttl', fallback=86400)
+        self.disk_cache = config.getboolean('disk_cache', 'enabled', fallback=True)
+        self.disk_cache_path = config.get('disk_cache', 'path', fallback='page_cache.sqlite')
+        self.disk_cache_bytes = config.getint('disk_cache', 'max_bytes', fallback=200000000)
+        self.disk_cache_fresh = config.getint('disk_cache', 'fresh', fallback=300)
+        self.partial_parse = config.getboolean('parser', 'partial', fallback=True)
+        self.stop_early = config.getboolean('parser', 'stop_early', fallback=True)
+        self.parser_backend, self.parser = html_parsers.get_backend(config.get('parser', 'backend', fallback='lxml'))
+        self.parse_executor = config.get('parser', 'executor', fallback='thread')
+        self.parse_workers = config.getint('parser', 'workers', fallback=2)
+        self.parse_queue = config.getint('parser', 'queue', fallback=32)
+        self.preview_deadline = config.getfloat('preview', 'deadline', fallback=5)
+        self.preview_refresh = config.getboolean('preview', 'refresh', fallback=True)
+        self.unfurl_wait = config.getint('preview', 'unfurl_wait', fallback=30)
+        self.unfurl_entries = config.getint('preview', 'unfurl_entries', fallback=1000)
+        self.preview_max_links = config.getint('preview', 'max_links', fallback=5)
+        self.metrics_host = config.get('metrics', 'host', fallback='127.0.0.1')
+        self.metrics_port = config.getint('metrics', 'port', fallback=0)
+        self.cluster_processes = config.getint('cluster', 'processes', fallback=1)
+        self.cluster_shards = config.getint('cluster', 'shards', fallback=0)
+        self.status_interval = config.getint('cluster', 'status_interval', fallback=30)
+        self.ui_lifetime = config.getint('ui', 'lifetime', fallback=86400)
+        self.ui_max_live = config.getint('ui', 'max_live', fallback=5000)
+        self.ui_sweep_interval = config.getint('ui', 'sweep_interval', fallback=60)
 
     def load_forum_settings(self):
-        self.sites = {}
-        with open('site_settings.json') as forum_data:
-            data = forum_data.read()
-            forums = json.loads(data)
-        for item in forums:
-            self.sites[item['name']] = (forum_settings(item['name'], item['base_url'], int(item['color']),
-                                                       item['forum_links']))
-        forum_data.close()
+        """Loads site settings and compiles the link matcher for them"""
+        self.sites = load_sites()
+        self.link_matcher = forum_link.link_matcher(self.sites)
+
+
+def load_sites(path='site_settings.json'):
+    """Reads forum settings from site_settings.json"""
+    sites = {}
+    with open(path) as forum_data:
+        data = forum_data.read()
+        forums = json.loads(data)
+    for item in forums:
+        sites[item['name']] = (forum_settings(item['name'], item['base_url'], int(item['color']),
+                                              item['forum_links'], item['extraction'], item.get('fetch', {})))
+    return sites
 
 
 class forum_settings():
     """Stores data related to forums for parsing and previews"""
-    def __init__(self, name, base_url, color, forum_links: dict):
+    def __init__(self, name, base_url, color, forum_links: dict, extraction_data: dict, fetch: dict):
         self.name = name
         self.base_url = base_url
         self.color = color
         self.forum_links = forum_links
+        self.plan = extraction.extraction_plan(extraction_data)
+        self.fetch = fetch
 
     def __repr__(self):
         return f'Name: {self.name} Base URL: {self.base_url} Color: {self.color}'
@@ -0,0 +1,32 @@
+import asyncio
+
+
+class single_flight():
+    """Deduplicates concurrent calls. The first caller for a key starts the work as its own task and every caller for
+    the same key awaits that task until it finishes. Callers wait through a shield so a cancelled caller never cancels
+    the shared work for the others. Nothing is kept once the work finishes, caching results is left to the caller."""
+    def __init__(self):
+        self.flights = {}
+
+    def __len__(self):
+        return len(self.flights)
+
+    def __contains__(self, key):
+        """Returns whether a call for key is running"""
+        return key in self.flights
+
+    async def run(self, key, func, *args):
+        """Awaits func(*args), or the already running call for key, and returns its result or raises its exception"""
+        task = self.flights.get(key)
+        if task is None:
+            task = asyncio.ensure_future(func(*args))
+            self.flights[key] = task
+            task.add_done_callback(lambda done: self.finish(key, done))
+        return await asyncio.shield(task)
+
+    def finish(self, key, task):
+        if self.flights.get(key) is task:
+            del self.flights[key]
+        if not task.cancelled():
+            # Marks the exception as retrieved in case every caller was cancelled before it was raised
+            task.exception()
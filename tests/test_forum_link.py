@@ -0,0 +1,52 @@
+import os
+import sys
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import forum_link
+
+
+def site(name, base_url, **forum_links):
+    return SimpleNamespace(name=name, base_url=base_url, forum_links=forum_links)
+
+
+ERA_POST = r'https://www\.resetera\.com/posts/(?P<id>\d+)'
+GAF_THREAD = r'https://www\.neogaf\.com/threads/[^\s/]+\.(?P<id>\d+)'
+
+
+def test_quantified_scheme():
+    """A format starting https?:// leaves a prefix ending just before the quantifier, which must stay attached"""
+    matcher = forum_link.link_matcher({
+        'era': site('era', 'https://www.resetera.com/', post=[ERA_POST.replace('https', 'https?')]),
+        'gaf': site('gaf', 'https://www.neogaf.com/', thread=[GAF_THREAD.replace('https', 'https?')]),
+    })
+    assert matcher.search('see http://www.resetera.com/posts/12/') == \
+        ('era', 'post', 'http://www.resetera.com/posts/12', '12')
+    assert matcher.search('see https://www.neogaf.com/threads/a-thread.34/') == \
+        ('gaf', 'thread', 'https://www.neogaf.com/threads/a-thread.34', '34')
+    assert matcher.search('htp://www.resetera.com/posts/12/') is None
+
+
+def test_shared_prefix_hoisted():
+    matcher = forum_link.link_matcher({
+        'era': site('era', 'https://www.resetera.com/', post=[ERA_POST]),
+        'gaf': site('gaf', 'https://www.neogaf.com/', thread=[GAF_THREAD]),
+    })
+    assert matcher.expression.pattern.startswith('https://www(?:')
+    content = 'https://www.neogaf.com/threads/x.1 https://www.resetera.com/posts/2'
+    assert [match[0] for match in matcher.finditer(content)] == ['gaf', 'era']
+
+
+def test_wrapped_links_left_out_before_limit():
+    """Links wrapped in <> don't use up the per message limit, and a wrapped link repeated bare is still previewed"""
+    settings = SimpleNamespace(preview_max_links=5, link_matcher=forum_link.link_matcher({
+        'era': site('era', 'https://www.resetera.com/', post=[ERA_POST]),
+    }))
+    wrapped = ' '.join(f'<https://www.resetera.com/posts/{i}>' for i in range(5))
+    message = SimpleNamespace(content=wrapped + ' https://www.resetera.com/posts/9', flags=None)
+    assert [link.post_id for link in forum_link.forum_links(message, settings)] == ['post-9']
+    message = SimpleNamespace(content='<https://www.resetera.com/posts/1> https://www.resetera.com/posts/1', flags=None)
+    assert [link.post_id for link in forum_link.forum_links(message, settings)] == ['post-1']
+    message = SimpleNamespace(content='https://www.resetera.com/posts/1', flags=SimpleNamespace(suppress_embeds=True))
+    assert forum_link.forum_links(message, settings) == []